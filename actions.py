@@ -1,111 +1,158 @@
-import keyboard
+import logging
+import time
+import threading
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import keyboard
+
+log = logging.getLogger(__name__)
 
 # def get_active_window_name():
 #    hwnd = win32gui.GetForegroundWindow()
 #    return win32gui.GetWindowText(hwnd)
 
+ACTION_WORKERS = 2
+ACTION_DEBOUNCE = 1.0  # seconds a repeated command is ignored after it ran
 
-apps = {
-    "vivaldi": "C:\\Users\\bnaya\\AppData\\Local\\Vivaldi\\Application\\vivaldi.exe",
-    "Code": "C:\\Program Files\\Microsoft VS Code\\Code.exe",
-    "EEZ Studio": "C:\\Users\\bnaya\\AppData\\Local\\Programs\\eezstudio\\EEZ Studio.exe",
-    "wps": "C:\\Users\\bnaya\\AppData\\Local\\Kingsoft\\WPS Office\\12.2.0.22222\\office6\\wps.exe",
-    "copyq": "C:\\Program Files\\CopyQ\\copyq.exe",
-    "Listary": "C:\\Program Files\\Listary\\Listary.exe",
-    "putty": "C:\\Program Files\\PuTTY\\putty.exe",
-    "HxD": "C:\\Program Files\\HxD\\HxD.exe",
-    "freecad": "C:\\Program Files\\FreeCAD 1.0\\bin\\freecad.exe",
-    "Wireshark": "C:\\Program Files\\Wireshark\\Wireshark.exe",
-    "7zFM": "C:\\Program Files\\7-Zip\\7zFM.exe",
-    "nw": "C:\\Program Files (x86)\\Open Source\\MeshCommander\\nw.exe",
-    "prusaslicer": "C:\\Program Files\\Prusa3D\\PrusaSlicer\\prusa-slicer.exe",
-    "balenaEtcher": "C:\\Users\\bnaya\\AppData\\Local\\balena_etcher\\app-2.1.0\\balenaEtcher.exe",
-    "Brother iPrintScan": "C:\\Program Files (x86)\\Brother\\iPrint&Scan\\Brother iPrint&Scan.exe",
-    "HWMonitor": "C:\\Program Files\\CPUID\\HWMonitor\\HWMonitor.exe",
-    "obs64": "C:\\Program Files\\obs-studio\\bin\\64bit\\obs64.exe",
-    "Telegram": "C:\\Users\\bnaya\\AppData\\Roaming\\Telegram Desktop\\Telegram.exe",
-    "VirtualBox": "C:\\Program Files\\Oracle\\VirtualBox\\VirtualBox.exe",
-    "vlc": "C:\\Program Files\\VideoLAN\\VLC\\vlc.exe",
-    "Zoom": "C:\\Users\\bnaya\\AppData\\Roaming\\Zoom\\bin\\Zoom.exe",
-    "fdm": "C:\\Program Files\\Softdeluxe\\Free Download Manager\\fdm.exe"
+# copy paste actions
+KEYBOARD_ACTIONS = {
+    "copy": "ctrl+c",
+    "paste": "ctrl+v",
+    "cut": "ctrl+x",
 }
 
+# board command -> apps.json key, for names the board spells differently.
+# Every apps.json key also works as is and in lower case.
+COMMAND_ALIASES = {
+    "eez_studio": "EEZ Studio",
+    "hx_d": "HxD",
+    "sevenz_fm": "7zFM",
+    "mesh_commander": "nw",
+    "prusa_slicer": "prusaslicer",
+    "balena_etcher": "balenaEtcher",
+    "brother_i_print_scan": "Brother iPrintScan",
+    "hw_monitor": "HWMonitor",
+    "obs": "obs64",
+    "virtual_box": "VirtualBox",
+}
 
 DETACHED_PROCESS = 0x00000008
 CREATE_NEW_CONSOLE = 0x00000010
 
 
-def launch_app(key: str):
-    exe_path = apps.get(key)
-    if not exe_path:
-        print(f"Unknown app: {key}")
-        return
-
+def launch_app(name, exe_path):
     try:
         # Launch as independent user process
         subprocess.Popen(exe_path, close_fds=True)
-        print(f"Launched {key} as independent process")
+        log.info("Launched %s as independent process", name)
     except Exception as e:
-        print(f"Failed to launch {key}: {e}")
-
-
-def do_action(command):
-    match command:
-        # copy paste actions
-        case "copy":
-            keyboard.press_and_release("ctrl+c")
-            print("copy")
-        case "paste":
-            keyboard.press_and_release("ctrl+v")
-            print("paste")
-        case "cut":
-            keyboard.press_and_release("ctrl+c")
-            print("cut")
-
-       # launch app actions
-    match command:
-        case "vivaldi":
-            launch_app("vivaldi")
-        case "code":
-            launch_app("Code")
-        case "eez_studio":
-            launch_app("EEZ Studio")
-        case "wps":
-            launch_app("wps")
-        case "copyq":
-            launch_app("copyq")
-        case "listary":
-            launch_app("Listary")
-        case "putty":
-            launch_app("putty")
-        case "hx_d":
-            launch_app("HxD")
-        case "freecad":
-            launch_app("freecad")
-        case "wireshark":
-            launch_app("Wireshark")
-        case "sevenz_fm":
-            launch_app("7zFM")
-        case "mesh_commander":
-            launch_app("nw")
-        case "prusa_slicer":
-            launch_app("prusaslicer")
-        case "balena_etcher":
-            launch_app("balenaEtcher")
-        case "brother_i_print_scan":
-            launch_app("Brother iPrintScan")
-        case "hw_monitor":
-            launch_app("HWMonitor")
-        case "obs":
-            launch_app("obs64")
-        case "telegram":
-            launch_app("Telegram")
-        case "virtual_box":
-            launch_app("VirtualBox")
-        case "vlc":
-            launch_app("vlc")
-        case "zoom":
-            launch_app("Zoom")
-        case _:
-            print(f"⚠️ No matching app for command: {command}")
+        log.error("Failed to launch %s: %s", name, e)
+
+
+def press_keys(name, keys):
+    keyboard.press_and_release(keys)
+    log.info("%s", name)
+
+
+class ActionDispatcher:
+    """
+    Command -> action table, built once by load() from the app registry and
+    KEYBOARD_ACTIONS. dispatch() is a dict lookup, the action itself runs in
+    a small worker pool so the read path never waits for a process spawn.
+    An app launch that is still running or ran less than debounce seconds
+    ago is dropped, so a bouncing button does not start the app twice. stats() has the latency from serial receipt to the action.
+    """
+
+    def __init__(self, workers=ACTION_WORKERS, debounce=ACTION_DEBOUNCE):
+        self.debounce = debounce
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="action")
+        self.table = {}
+        self._lock = threading.Lock()
+        self._last_run = {}   # command -> monotonic time it was accepted
+        self._running = set()
+
+        self.counts = {}
+        self.debounced = 0
+        self.unknown = 0
+        self.latency_total = {}
+        self.latency_max = {}
+
+    def load(self, registry):
+        """Build the table from registry entries {key: {"exe_path": ...}}."""
+        table = {}
+        for command, keys in KEYBOARD_ACTIONS.items():
+            table[command] = (press_keys, (command, keys))
+        for key, entry in registry.items():
+            exe_path = entry.get("exe_path")
+            if not exe_path:
+                continue
+            table.setdefault(key, (launch_app, (key, exe_path)))
+            table.setdefault(key.lower(), (launch_app, (key, exe_path)))
+        for command, key in COMMAND_ALIASES.items():
+            if key in table:
+                table.setdefault(command, table[key])
+        with self._lock:
+            self.table = table
+        return len(table)
+
+    def dispatch(self, command, received_at=None):
+        """Queue the action for command; received_at is time.monotonic() at serial receipt."""
+        received_at = time.monotonic() if received_at is None else received_at
+        action = self.table.get(command)
+        if action is None:
+            self.unknown += 1
+            log.warning("No matching action for command: %s", command)
+            return False
+
+        with self._lock:
+            if action[0] is launch_app:
+                last = self._last_run.get(command)
+                if command in self._running or (last is not None and received_at - last < self.debounce):
+                    self.debounced += 1
+                    return False
+                self._last_run[command] = received_at
+            self._running.add(command)
+        self.executor.submit(self._run, command, action, received_at)
+        return True
+
+    def _run(self, command, action, received_at):
+        func, args = action
+        try:
+            func(*args)
+        except Exception as e:
+            log.error("Action %s failed: %s", command, e)
+        finally:
+            latency = time.monotonic() - received_at
+            with self._lock:
+                self._running.discard(command)
+                self.counts[command] = self.counts.get(command, 0) + 1
+                self.latency_total[command] = self.latency_total.get(command, 0.0) + latency
+                self.latency_max[command] = max(self.latency_max.get(command, 0.0), latency)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "commands": len(self.table),
+                "debounced": self.debounced,
+                "unknown": self.unknown,
+                "latency_ms": {
+                    command: {
+                        "count": count,
+                        "avg": self.latency_total[command] / count * 1000,
+                        "max": self.latency_max[command] * 1000,
+                    }
+                    for command, count in self.counts.items()
+                },
+            }
+
+
+dispatcher = ActionDispatcher()
+
+
+def load_actions(registry):
+    return dispatcher.load(registry)
+
+
+def do_action(command, received_at=None):
+    return dispatcher.dispatch(command, received_at)
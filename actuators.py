@@ -0,0 +1,115 @@
+import logging
+import time
+import threading
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+CALL_SECONDS = metrics.histogram("actuator_call_seconds", "Time in the OS call of an actuator", ("actuator",))
+
+# minimum seconds between two calls to the same actuator
+BRIGHTNESS_MIN_INTERVAL = 0.1
+VOLUME_MIN_INTERVAL = 0.03
+
+
+class CoalescingActuator:
+    """
+    Last value wins actuator stage. submit() only stores the newest setpoint
+    and returns right away; one worker thread applies it, rate limited to one
+    call per min_interval. Setpoints replaced before they were applied are
+    counted as dropped.
+    """
+
+    def __init__(self, name, apply, min_interval=0.0, thread_init=None):
+        self.name = name
+        self.apply = apply
+        self.min_interval = min_interval
+        self.thread_init = thread_init
+
+        self._cond = threading.Condition()
+        self._pending = None
+        self._has_pending = False
+        self._running = False
+        self._thread = None
+
+        self.submitted = 0
+        self.applied = 0
+        self.dropped = 0
+        self.errors = 0
+        self.last_call_ms = 0.0
+        self.max_call_ms = 0.0
+
+    def start(self):
+        with self._cond:
+            if self._running:
+                return
+            self._running = True
+        self._thread = threading.Thread(
+            target=self._run, name=f"actuator-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, value):
+        with self._cond:
+            if self._has_pending:
+                self.dropped += 1
+            self._pending = value
+            self._has_pending = True
+            self.submitted += 1
+            self._cond.notify()
+
+    def _take(self):
+        with self._cond:
+            while self._running and not self._has_pending:
+                self._cond.wait()
+            if not self._running:
+                return False, None
+            value = self._pending
+            self._pending = None
+            self._has_pending = False
+            return True, value
+
+    def _run(self):
+        if self.thread_init is not None:
+            self.thread_init()
+        next_allowed = 0.0
+        call_seconds = CALL_SECONDS.labels(self.name)
+        while True:
+            # rate limit first, newer setpoints keep replacing the pending one meanwhile
+            delay = next_allowed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+            ok, value = self._take()
+            if not ok:
+                return
+
+            start = time.perf_counter()
+            try:
+                with call_seconds.time():
+                    self.apply(value)
+                self.applied += 1
+            except Exception as e:
+                self.errors += 1
+                log.error("%s actuator error: %s", self.name, e)
+            self.last_call_ms = (time.perf_counter() - start) * 1000
+            self.max_call_ms = max(self.max_call_ms, self.last_call_ms)
+            next_allowed = time.monotonic() + self.min_interval
+
+    def stats(self):
+        return {
+            "submitted": self.submitted,
+            "applied": self.applied,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "last_call_ms": self.last_call_ms,
+            "max_call_ms": self.max_call_ms,
+        }
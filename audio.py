@@ -1,34 +1,163 @@
+import logging
 import platform
+import threading
+
+log = logging.getLogger(__name__)
 
 system_type = platform.system()
 
 if system_type == "Windows":
     from pycaw.pycaw import AudioUtilities, IAudioEndpointVolume
-    from comtypes import CLSCTX_ALL
+    from pycaw.api.endpointvolume import IAudioEndpointVolumeCallback
+    from pycaw.api.mmdeviceapi import IMMNotificationClient
+    from comtypes import CLSCTX_ALL, COMObject
 
+    class _VolumeCallback(COMObject):
+        _com_interfaces_ = [IAudioEndpointVolumeCallback]
 
-def get_volume():
-    if system_type == "Windows":
+        def OnNotify(self, pNotify):
+            data = pNotify.contents
+            _volume_changed(int(round(data.fMasterVolume * 100)))
+            return 0
+
+    _E_RENDER = 0  # EDataFlow.eRender, GetSpeakers() is a render endpoint
+
+    class _DeviceCallback(COMObject):
+        # MMDevice callbacks must not block: they only mark the endpoint
+        # stale, the rebuild happens on the next get_volume()
+        _com_interfaces_ = [IMMNotificationClient]
+
+        def OnDefaultDeviceChanged(self, flow, role, pwstrDeviceId):
+            if flow == _E_RENDER:
+                _default_device_changed()
+            return 0
+
+        def OnDeviceStateChanged(self, pwstrDeviceId, dwNewState):
+            if pwstrDeviceId == _default_id:
+                _default_device_changed()
+            return 0
+
+        def OnDeviceAdded(self, pwstrDeviceId):
+            return 0
+
+        def OnDeviceRemoved(self, pwstrDeviceId):
+            return 0
+
+        def OnPropertyValueChanged(self, pwstrDeviceId, key):
+            return 0
+
+
+# Activating the endpoint is a COM round trip, so the interface is cached per
+# thread (COM pointers should not hop apartments) and rebuilt only when the
+# default device changes, which bumps _generation.
+_cache = threading.local()
+_lock = threading.Lock()
+_generation = 0
+_default_id = None  # id of the endpoint the change notifications are registered on
+_rebind_needed = False
+
+# change notifications
+_listeners = []
+_last_volume = None
+_notify_endpoint = None
+_volume_callback = None
+_device_callback = None
+_enumerator = None
+
+
+def _endpoint_volume():
+    if getattr(_cache, "generation", None) != _generation:
         devices = AudioUtilities.GetSpeakers()
         interface = devices.Activate(
             IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
-        volume = interface.QueryInterface(IAudioEndpointVolume)
+        _cache.volume = interface.QueryInterface(IAudioEndpointVolume)
+        _cache.generation = _generation
+    return _cache.volume
+
+
+def _volume_changed(volume):
+    global _last_volume
+    if volume == _last_volume:
+        return
+    _last_volume = volume
+    for callback in list(_listeners):
+        try:
+            callback(volume)
+        except Exception as e:
+            log.error("Volume listener error: %s", e)
+
+
+def _default_device_changed():
+    # runs inside the MMDevice callback: no locks, no COM calls
+    global _generation, _last_volume, _rebind_needed
+    _generation += 1
+    _last_volume = None
+    _rebind_needed = True
+
+
+def _register_volume_callback():
+    global _notify_endpoint, _volume_callback, _default_id, _rebind_needed
+    with _lock:
+        if _notify_endpoint is not None:
+            try:
+                _notify_endpoint.UnregisterControlChangeNotify(_volume_callback)
+            except Exception:
+                pass
+        devices = AudioUtilities.GetSpeakers()
+        _default_id = devices.GetId()
+        interface = devices.Activate(
+            IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
+        _notify_endpoint = interface.QueryInterface(IAudioEndpointVolume)
+        _volume_callback = _VolumeCallback()
+        _notify_endpoint.RegisterControlChangeNotify(_volume_callback)
+        current = int(_notify_endpoint.GetMasterVolumeLevelScalar() * 100)
+        _rebind_needed = False
+    _volume_changed(current)
+
+
+def add_volume_listener(callback):
+    """
+    Call callback(volume) whenever the master volume or the default device
+    changes. While a listener is registered get_volume() answers from the
+    last notified value instead of asking COM.
+    Returns False when the platform has no change notifications.
+    """
+    global _device_callback, _enumerator
+    if system_type != "Windows":
+        return False
+
+    _listeners.append(callback)
+    if _device_callback is None:
+        _enumerator = AudioUtilities.GetDeviceEnumerator()
+        _device_callback = _DeviceCallback()
+        _enumerator.RegisterEndpointNotificationCallback(_device_callback)
+    if _notify_endpoint is None:
+        _register_volume_callback()
+    return True
+
+
+def get_volume():
+    if system_type == "Windows":
+        if _listeners and _rebind_needed:
+            # the default device changed, follow it here rather than in the callback
+            _register_volume_callback()
+        if _listeners and _last_volume is not None:
+            return _last_volume
+
+        volume = _endpoint_volume()
         vol_now = int(volume.GetMasterVolumeLevelScalar() * 100)
 
         return vol_now
 
     elif system_type == "Linux":
-        print("linux dose not support audio control yet")
+        log.debug("linux dose not support audio control yet")
         return None
     else:
-        print("the system dose not support audio control")
+        log.debug("the system dose not support audio control")
         return None
 
 
 def set_volume(var_set_volume):
     if system_type == "Windows":
-        devices = AudioUtilities.GetSpeakers()
-        interface = devices.Activate(
-            IAudioEndpointVolume._iid_, CLSCTX_ALL, None)
-        volume = interface.QueryInterface(IAudioEndpointVolume)
+        volume = _endpoint_volume()
         volume.SetMasterVolumeLevelScalar(var_set_volume / 100, None)
@@ -0,0 +1,542 @@
+import os
+import sys
+import json
+import time
+import types
+import zlib
+import struct
+import tempfile
+import importlib
+import threading
+import contextlib
+import multiprocessing
+from datetime import datetime
+
+import serial
+from PIL import Image, ImageDraw
+
+from lvgl import encode_lvgl_bin, encode_lvgl_bins, LV_IMG_CF_TRUE_COLOR, ICON_SIZE
+from protocol import get_codec, PROTOCOL_JSON, PROTOCOL_BINARY
+from serial_writer import SerialWriter, PRIORITY_BULK
+from icon_transfer import IconTransfer, encode_payload, XFER_WINDOWED, ENC_RAW, ENC_RLE
+from fake_device import FakeDevice, FdPort, open_pty_pair
+
+# -----------------------------
+# Benchmarks
+# -----------------------------
+# python bench.py [name ...]    runs the named benchmarks, all of them by default
+# Results are appended to BENCH_RESULTS and every number is printed with its
+# change against the previous run, so regressions show up.
+
+BENCH_RESULTS = "bench_results.json"
+KEEP_RESULTS = 20  # stored runs per benchmark
+
+
+def _timed(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _random_icons(count, size=(256, 256)):
+    return [Image.frombytes("RGBA", size, os.urandom(size[0] * size[1] * 4))
+            for _ in range(count)]
+
+
+# ------------ Icon conversion ------------
+
+
+def convert_per_pixel(img, size=ICON_SIZE):
+    """The original convert_png_to_lvgl_bin loop, kept as the reference."""
+    img = img.convert("RGB").resize(size, Image.Resampling.LANCZOS)
+    width, height = img.size
+    pixels = list(img.getdata())
+
+    header = b"LVGL" + struct.pack("<HHB", width, height, LV_IMG_CF_TRUE_COLOR)
+
+    pixel_data = bytearray()
+    for r, g, b in pixels:
+        rgb565 = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+        pixel_data += struct.pack("<H", rgb565)
+    return header + pixel_data
+
+
+def bench_icon_conversion(count=24, size=ICON_SIZE, repeat=3):
+    icons = _random_icons(count)
+
+    reference = [convert_per_pixel(img, size) for img in icons]
+    if [encode_lvgl_bin(img, size) for img in icons] != reference:
+        raise AssertionError("encode_lvgl_bin output differs from the per pixel loop")
+    if encode_lvgl_bins(icons, size) != reference:
+        raise AssertionError("encode_lvgl_bins output differs from the per pixel loop")
+
+    per_pixel = _timed(lambda: [convert_per_pixel(img, size) for img in icons], repeat)
+    single = _timed(lambda: [encode_lvgl_bin(img, size) for img in icons], repeat)
+    batch = _timed(lambda: encode_lvgl_bins(icons, size), repeat)
+
+    return {
+        "icons": count,
+        "size": f"{size[0]}x{size[1]}",
+        "per_pixel_ms": per_pixel * 1000,
+        "single_ms": single * 1000,
+        "batch_ms": batch * 1000,
+        "speedup": per_pixel / batch if batch else 0.0,
+    }
+
+
+# ------------ Icon transfer ------------
+
+
+def _drawn_icons(count):
+    """Icon-like images: flat background with a few shapes, like real app icons."""
+    icons = []
+    for i in range(count):
+        img = Image.new("RGBA", (128, 128), (0, 0, 0, 0))
+        draw = ImageDraw.Draw(img)
+        draw.ellipse((8, 8, 120, 120), fill=(40 + i * 8 % 200, 90, 200, 255))
+        draw.rectangle((36 + i % 20, 40, 92, 88), fill=(240, 200, 40 + i * 5 % 200, 255))
+        draw.line((0, 127, 127, 0), fill=(255, 255, 255, 255), width=3)
+        icons.append(encode_lvgl_bin(img))
+    return icons
+
+
+class _HostLink:
+    """Host end of a pty link: handshake, SerialWriter and a reader thread."""
+
+    def __init__(self, path, binary):
+        self.port = serial.Serial(path, 460800, timeout=0.1)
+        self.port.write(b"host_ok " + PROTOCOL_BINARY.encode() if binary else b"host_ok")
+        reply = b""
+        deadline = time.monotonic() + 5
+        while b"ESP32_ok" not in reply and time.monotonic() < deadline:
+            reply += self.port.read(64)
+        self.codec = get_codec(PROTOCOL_BINARY if PROTOCOL_BINARY.encode() in reply
+                               else PROTOCOL_JSON)
+        self.decoder = self.codec.decoder()
+        self.writer = SerialWriter(self.port)
+        self.icon_requested = threading.Event()
+        self.transfer = None
+        self._running = True
+        self._threads = [threading.Thread(target=self.writer.run, daemon=True),
+                         threading.Thread(target=self._read, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def _read(self):
+        while self._running:
+            data = self.port.read(max(1, self.port.in_waiting))
+            for msg in self.decoder.feed(data) if data else []:
+                if "waiting_for_icon" in msg:
+                    self.icon_requested.set()
+                elif "ack" in msg and self.transfer is not None:
+                    self.transfer.on_ack(msg["ack"])
+
+    def send_icon(self, name, icon_data, enc=None):
+        message = {"new_app": name, "height": 100, "width": 100,
+                   "size": len(icon_data), "crc": zlib.crc32(icon_data), "score": 0}
+        payload = icon_data
+        if enc is not None:
+            enc, payload = encode_payload(icon_data, enc)
+            message.update(xfer=XFER_WINDOWED, enc=enc, zsize=len(payload))
+        self.icon_requested.clear()
+        self.writer.submit(self.codec.encode(message), PRIORITY_BULK)
+        if not self.icon_requested.wait(2):
+            raise RuntimeError("board did not request the icon")
+
+        retransmits = 0
+        if enc is not None:
+            self.transfer = IconTransfer(payload, lambda seq, chunk: self.writer.submit(
+                self.codec.encode_chunk(seq, chunk), PRIORITY_BULK, paced=False))
+            if not self.transfer.run():
+                raise RuntimeError("windowed transfer failed")
+            retransmits = self.transfer.retransmits
+            self.transfer = None
+            self.writer.submit(self.codec.encode({"done": "done"}), PRIORITY_BULK)
+        else:
+            self.writer.submit_bulk(icon_data, self.codec.encode_raw,
+                                    trailer=self.codec.encode({"done": "done"}),
+                                    exclusive=self.codec.name == PROTOCOL_JSON)
+        return len(payload), retransmits
+
+    def close(self):
+        self._running = False
+        self.writer.stop()
+        for thread in self._threads:
+            thread.join()
+        self.port.close()
+
+
+def _run_transfer(icons, binary, enc, drop_rate=0.0):
+    master, slave, path = open_pty_pair()
+    device = FakeDevice(FdPort(master), supports_binary=binary, drop_rate=drop_rate, seed=1)
+    device_thread = threading.Thread(target=device.run, daemon=True)
+    device_thread.start()
+    host = _HostLink(path, binary)
+    os.close(slave)
+
+    wire_bytes = retransmits = 0
+    start = time.perf_counter()
+    for i, icon_data in enumerate(icons):
+        sent, resent = host.send_icon(f"app{i}", icon_data, enc)
+        wire_bytes += sent
+        retransmits += resent
+    while len(device.icons) + len(device.bad_icons) < len(icons):
+        if time.perf_counter() - start > 60:
+            raise RuntimeError("board did not receive every icon")
+        time.sleep(0.001)
+    elapsed = time.perf_counter() - start
+
+    host.close()
+    device.stop()
+    device_thread.join()
+    os.close(master)
+    if device.bad_icons:
+        raise AssertionError(f"corrupted icons: {device.bad_icons}")
+    return {
+        "ms": elapsed * 1000,
+        "icon_kbps": sum(map(len, icons)) / elapsed / 1024,
+        "wire_bytes": wire_bytes,
+        "retransmits": retransmits,
+    }
+
+
+def bench_icon_transfer(count=8):
+    """Legacy paced chunks vs the windowed transfer, raw and RLE, over a pty pair."""
+    icons = _drawn_icons(count)
+    result = {"icons": count, "icon_bytes": sum(map(len, icons))}
+    runs = {
+        "legacy": (False, None, 0.0),
+        "windowed_raw": (True, ENC_RAW, 0.0),
+        "windowed_rle": (True, ENC_RLE, 0.0),
+        "windowed_rle_5pct_loss": (True, ENC_RLE, 0.05),
+    }
+    for name, (binary, enc, drop_rate) in runs.items():
+        for key, value in _run_transfer(icons, binary, enc, drop_rate).items():
+            result[f"{name}_{key}"] = value
+    return result
+
+
+# ------------ End-to-end session ------------
+# main.run_session() against a scripted FakeDevice over a pty pair, with the
+# OS backends (volume, brightness, key presses, app launches) replaced by
+# recorders. Windows-only modules that are not installed get empty stand-ins
+# so main.py imports on Linux. main.py and icons.py keep module state (the
+# registry, icon folders in the cwd, started services), so every benchmark
+# that imports them runs in a fresh process.
+
+SESSION_SCRIPT = [
+    ("wait", 0.5),
+    ("slider", "setVolume", list(range(0, 101, 2)), 0.01),
+    ("command", "copy", 10, 0.05),
+    ("noise", 64),
+    ("slider", "setBrightness", list(range(100, -1, -2)), 0.01),
+    ("command", "vlc", 3, 0.05),        # debounced to one launch
+    ("keyframe",),
+    ("noise", 200),
+    ("slider", "setVolume", list(range(1, 100, 2)), 0.005),
+    ("command", "paste", 10, 0.02),
+    ("wait", 1.0),
+]
+
+_WINDOWS_STUBS = {
+    "pythoncom": {"CoInitialize": lambda: None},
+    "win32gui": {"EnumWindows": lambda callback, extra: None,
+                 "IsWindowVisible": lambda hwnd: False},
+    "win32process": {"GetWindowThreadProcessId": lambda hwnd: (0, 0)},
+    "keyboard": {"press_and_release": lambda keys: None},
+    "screen_brightness_control": {"get_brightness": lambda display=None: [50],
+                                  "set_brightness": lambda value, display=None: None},
+}
+
+
+def _stub_missing_modules():
+    for name, attrs in _WINDOWS_STUBS.items():
+        try:
+            importlib.import_module(name)
+        except ImportError:
+            module = types.ModuleType(name)
+            module.__dict__.update(attrs)
+            sys.modules[name] = module
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "max": 0.0}
+
+    def pick(q):
+        return values[min(len(values) - 1, int(q * len(values)))] * 1000
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "max": values[-1] * 1000}
+
+
+def _match_latencies(sent_log, actuations):
+    """Latency from each scripted message to the first matching actuation after it."""
+    latencies = []
+    used = set()
+    for sent_at, msg in sent_log:
+        (key, value), = msg.items()
+        for i, (done_at, done_key, done_value) in enumerate(actuations):
+            if i not in used and done_key == key and done_value == value and done_at >= sent_at:
+                used.add(i)
+                latencies.append(done_at - sent_at)
+                break
+    return latencies
+
+
+def _in_fresh_process(func, *args):
+    """Run func(*args) in a new interpreter and return its result."""
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(func, args)
+
+
+@contextlib.contextmanager
+def _host(icons=0):
+    """
+    Yields (main module, actuations) in a temp working dir, with recorders
+    instead of the OS backends and icons drawn apps in the registry.
+    actuations gets (time.monotonic(), key, value) for every applied change.
+    """
+    _stub_missing_modules()
+    workdir = tempfile.TemporaryDirectory()
+    cwd = os.getcwd()
+    sys.path.insert(0, cwd)
+    os.chdir(workdir.name)  # icons.py keeps its registry and folders in the cwd
+    try:
+        import main as host
+        import actions
+        import serial_device
+        from icons import registry_store, app_ranking, write_icon_bin, LVGL_BIN_FOLDER
+
+        # registry with a few icons for the icon sync
+        for i, icon_data in enumerate(_drawn_icons(icons)):
+            name = f"app{i}"
+            bin_path = os.path.join(LVGL_BIN_FOLDER, f"{name}.bin")
+            entry = {"exe_path": f"/usr/bin/{name}", "friendly_name": name,
+                     "icon_bin": bin_path, "icon_png": "", "times_run": 1, "last_run": None}
+            entry.update(write_icon_bin(icon_data, bin_path))
+            entry["rank_key"] = app_ranking.record_launch(name)
+            registry_store.put(name, entry)
+        registry_store.put("vlc", {"exe_path": "/usr/bin/vlc", "friendly_name": "vlc"})
+
+        # recorders instead of the OS backends
+        actuations = []
+        state = {"volume": 50, "brightness": 50}
+
+        def actuator(key, state_key):
+            def apply(value):
+                state[state_key] = value
+                actuations.append((time.monotonic(), key, value))
+            return apply
+
+        serial_device.get_volume = lambda: state["volume"]
+        serial_device.get_brightness = lambda: state["brightness"]
+        host.volume_actuator.apply = actuator("setVolume", "volume")
+        host.brightness_actuator.apply = actuator("setBrightness", "brightness")
+        actions.press_keys = lambda name, keys: actuations.append((time.monotonic(), "command", name))
+        actions.launch_app = lambda name, exe: actuations.append((time.monotonic(), "command", name))
+        yield host, actuations
+        registry_store.close()
+    finally:
+        os.chdir(cwd)
+        sys.path.remove(cwd)
+        workdir.cleanup()
+
+
+def bench_session(script=SESSION_SCRIPT, icons=6, binary=True, capture_dir=None, boot_delay=0.3):
+    """Full host session against the fake board: throughput, latency and host CPU."""
+    return _in_fresh_process(_bench_session, script, icons, binary, capture_dir, boot_delay)
+
+
+def _bench_session(script, icons, binary, capture_dir, boot_delay):
+    with _host(icons) as (host, actuations):
+        host.USE_BINARY_PROTOCOL = binary
+        host.CAPTURE_DIR = capture_dir
+        host.start_services()
+
+        master, slave, path = open_pty_pair()
+        device = FakeDevice(FdPort(master), supports_binary=binary, seed=1, boot_delay=boot_delay)
+        device_cpu = {}
+
+        def run_device():
+            device.run()
+            device_cpu["run"] = time.thread_time()
+
+        def play():
+            device.play(script)
+            device_cpu["play"] = time.thread_time()
+            host.board_is_connected.clear()  # ends run_session
+
+        threads = [threading.Thread(target=run_device, daemon=True),
+                   threading.Thread(target=play, daemon=True)]
+        port = serial.Serial(path, 460800, timeout=0.1)
+        os.close(slave)
+        opened_at = time.monotonic()
+
+        cpu_start = time.process_time()
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        engine = host.run_session(port)
+        elapsed = time.perf_counter() - start
+        threads[1].join()
+        device.stop()
+        port.close()
+        threads[0].join()
+        os.close(master)
+        host_cpu = time.process_time() - cpu_start - sum(device_cpu.values())
+
+    if engine is None:
+        raise RuntimeError("handshake with the fake board failed")
+
+    writer = engine.writer.stats()
+    decoder = engine.decoder.stats()
+    sent = sum(writer["sent"].values())
+    sliders = [(t, msg) for t, msg in device.sent_log if "setVolume" in msg or "setBrightness" in msg]
+    commands = [(t, msg) for t, msg in device.sent_log if "command" in msg]
+    first_telemetry = engine.writer.first_telemetry_at
+    return {
+        "protocol": engine.codec.name,
+        "seconds": elapsed,
+        "handshake_ms": (device.connected_at - opened_at) * 1000,
+        "first_telemetry_ms": (first_telemetry - opened_at) * 1000 if first_telemetry else None,
+        "host_msgs_per_s": sent / elapsed,
+        "host_bytes_per_s": writer["bytes_written"] / elapsed,
+        "board_msgs_per_s": decoder["frames"] / elapsed,
+        "icons_received": len(device.icons),
+        "decode_errors": decoder["errors"],
+        "resyncs": decoder["resyncs"],
+        "noise_bytes": device.noise_bytes,
+        "slider_latency_ms": _percentiles(_match_latencies(sliders, actuations)),
+        "command_latency_ms": _percentiles(_match_latencies(commands, actuations)),
+        "slider_values_applied": sum(1 for a in actuations if a[1] != "command"),
+        "slider_values_sent": len(sliders),
+        "commands_run": sum(1 for a in actuations if a[1] == "command"),
+        "host_cpu_s": host_cpu,
+        "host_cpu_pct": host_cpu / elapsed * 100,
+    }
+
+
+# ------------ Replay ------------
+
+
+class _ReplayEngine:
+    """What handle_message needs from a SerialEngine, replies are encoded and dropped."""
+
+    def __init__(self, codec):
+        self.codec = codec
+        self.received_at = 0.0
+        self.replies = 0
+
+    def push(self, msg, priority):
+        self.codec.encode(msg)
+        self.replies += 1
+
+    def wake(self):
+        pass
+
+
+def replay_handled(path, realtime=False):
+    """
+    Replay a capture through the decoder and main.handle_message with the
+    OS backends recorded instead of applied (run it in a fresh process).
+    """
+    from capture import replay_reads, capture_protocol
+    with _host() as (host, actuations):
+        host.start_services()
+        engine = _ReplayEngine(get_codec(capture_protocol(path) or PROTOCOL_JSON))
+
+        def handle(msg):
+            engine.received_at = time.monotonic()
+            host.handle_message(engine, msg)
+        result = replay_reads(path, handle, realtime)
+        result["replies"] = engine.replies
+        result["actions"] = host.action_dispatcher.stats()
+    return result
+
+
+def bench_replay(binary=True):
+    """
+    Capture a session against the fake board, then replay its reads as fast
+    as possible: through the decoder alone, and through decoder + handle_message.
+    """
+    from capture import replay_reads
+    with tempfile.TemporaryDirectory() as capture_dir:
+        bench_session(binary=binary, capture_dir=capture_dir)
+        path = os.path.join(capture_dir, os.listdir(capture_dir)[0])
+        capture_bytes = os.path.getsize(path)
+        decoded = replay_reads(path)
+        handled = _in_fresh_process(replay_handled, path)
+    return {
+        "protocol": decoded["protocol"],
+        "capture_bytes": capture_bytes,
+        "messages": decoded["messages"],
+        "bytes": decoded["bytes"],
+        "msgs_per_s": decoded["msgs_per_s"],
+        "mb_per_s": decoded["mb_per_s"],
+        "decode_errors": decoded["decoder"]["errors"],
+        "handled_msgs_per_s": handled["msgs_per_s"],
+        "handled_replies": handled["replies"],
+    }
+
+
+BENCHMARKS = {
+    "icon_conversion": bench_icon_conversion,
+    "icon_transfer": bench_icon_transfer,
+    "session": bench_session,
+    "replay": bench_replay,
+}
+
+
+# ------------ Stored results ------------
+
+
+def _flatten(result, prefix=""):
+    flat = {}
+    for key, value in result.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        else:
+            flat[prefix + key] = value
+    return flat
+
+
+def load_results(path=BENCH_RESULTS):
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def store_result(results, name, result, path=BENCH_RESULTS):
+    runs = results.setdefault(name, [])
+    runs.append({"time": datetime.now().isoformat(timespec="seconds"), "result": result})
+    del runs[:-KEEP_RESULTS]
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def main(names):
+    results = load_results()
+    for name in names or BENCHMARKS:
+        result = _flatten(BENCHMARKS[name]())
+        previous = results.get(name, [])
+        last = _flatten(previous[-1]["result"]) if previous else {}
+        print(f"{name}:")
+        for key, value in result.items():
+            change = ""
+            old = last.get(key)
+            if isinstance(value, (int, float)) and isinstance(old, (int, float)) and old:
+                change = f"  ({(value - old) / abs(old) * 100:+.1f}% vs {previous[-1]['time']})"
+            if isinstance(value, float):
+                value = f"{value:.2f}"
+            print(f"  {key}: {value}{change}")
+        store_result(results, name, result)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
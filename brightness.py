@@ -1,12 +1,160 @@
+import logging
+import os
+import time
+import threading
+
 import screen_brightness_control as sbc
 
-# get the brightness
-brightness = sbc.get_brightness()
-print(brightness)
-# get the brightness for the primary monitor
-primary = sbc.get_brightness(display=0)[0]
-print(primary)
-# set the brightness to 100%
-sbc.set_brightness(100)
-# set the brightness to 100% for the primary monitor
-#
+log = logging.getLogger(__name__)
+
+BACKLIGHT_ROOT = "/sys/class/backlight"
+DDC_CACHE_TTL = 2.0  # seconds a DDC / WMI brightness read stays valid
+
+
+class SysfsBacklight:
+    """Reads a /sys/class/backlight device through one reused file handle."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "max_brightness"), "rb") as f:
+            self.max_brightness = int(f.read().strip()) or 1
+        self._fd = os.open(os.path.join(path, "brightness"), os.O_RDONLY)
+
+    def get(self):
+        raw = int(os.pread(self._fd, 32, 0).strip())
+        return round(raw * 100 / self.max_brightness)
+
+    def close(self):
+        os.close(self._fd)
+
+
+def find_backlight(sysfs_root=BACKLIGHT_ROOT):
+    """Return a SysfsBacklight for the first usable device under sysfs_root, or None."""
+    try:
+        names = sorted(os.listdir(sysfs_root))
+    except OSError:
+        return None
+    for name in names:
+        path = os.path.join(sysfs_root, name)
+        try:
+            return SysfsBacklight(path)
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+class BrightnessProvider:
+    """
+    Brightness reads for the fast loop.
+    - a sysfs backlight is read directly, it is cheap
+    - otherwise screen_brightness_control is asked at most once per ttl
+      (it may shell out to ddcutil / xrandr or go through WMI)
+    - set_brightness() sets every display through screen_brightness_control,
+      like the board slider always did, and updates the cached value so the
+      host does not read back what it just wrote
+    """
+
+    def __init__(self, display=0, sysfs_root=BACKLIGHT_ROOT, ttl=DDC_CACHE_TTL, backend=sbc):
+        self.display = display
+        self.ttl = ttl
+        self.backend = backend
+        self.backlight = find_backlight(sysfs_root)
+
+        self._lock = threading.Lock()
+        self._cached = None
+        self._cached_at = 0.0
+        self._failing = False
+
+        self.reads = 0
+        self.backend_errors = 0
+        self.cache_hits = 0
+        self.backend_reads = 0
+
+    def get_brightness(self):
+        self.reads += 1
+        if self.backlight is not None:
+            try:
+                return self.backlight.get()
+            except (OSError, ValueError) as e:
+                log.warning("Backlight read failed, falling back to sbc: %s", e)
+                self.backlight = None
+
+        with self._lock:
+            now = time.monotonic()
+            if (self._cached is not None or self._failing) and now - self._cached_at < self.ttl:
+                self.cache_hits += 1
+                return self._cached
+
+        try:
+            value = int(self.backend.get_brightness(display=self.display)[0])
+        except Exception as e:
+            # e.g. a monitor without DDC/CI: keep the last value (None is not sent),
+            # and try again after ttl instead of on every fast message
+            self.backend_errors += 1
+            if not self._failing:
+                log.warning("Brightness read failed, using the last value: %s", e)
+            self._failing = True
+            with self._lock:
+                self._cached_at = time.monotonic()
+                return self._cached
+        self._failing = False
+        self.backend_reads += 1
+        with self._lock:
+            self._cached = value
+            self._cached_at = time.monotonic()
+        return value
+
+    def set_brightness(self, value):
+        value = int(value)
+        self.backend.set_brightness(value)  # all displays, the backlight included
+
+        with self._lock:
+            self._cached = value
+            self._cached_at = time.monotonic()
+
+    def invalidate(self):
+        with self._lock:
+            self._cached = None
+
+    def stats(self):
+        return {
+            "source": "sysfs" if self.backlight is not None else "sbc",
+            "reads": self.reads,
+            "cache_hits": self.cache_hits,
+            "backend_reads": self.backend_reads,
+            "backend_errors": self.backend_errors,
+        }
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider():
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = BrightnessProvider()
+        return _provider
+
+
+def get_brightness():
+    return get_provider().get_brightness()
+
+
+def set_brightness(value):
+    get_provider().set_brightness(value)
+
+
+if __name__ == "__main__":
+    # get the brightness
+    brightness = sbc.get_brightness()
+    print(brightness)
+    # get the brightness for the primary monitor
+    primary = sbc.get_brightness(display=0)[0]
+    print(primary)
+    # set the brightness to 100%
+    sbc.set_brightness(100)
+    # set the brightness to 100% for the primary monitor
+    #
+    print(get_provider().stats())
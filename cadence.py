@@ -0,0 +1,81 @@
+import time
+
+# -----------------------------
+# Adaptive send cadence
+# -----------------------------
+# A periodic sender asks next_interval() how long to wait before the next
+# message:
+#   congested  the OS transmit buffer holds more than out_waiting_high bytes
+#              or frames of this class are still queued: the interval doubles
+#              (up to idle_interval) so the link can drain
+#   changing   the last message differed from the one before, or did within
+#              the last hold seconds: min_interval
+#   idle       values are steady: the interval grows by backoff per message
+#              up to idle_interval
+# The current interval and reason, and how often and how long each reason
+# was in effect, are in stats().
+
+REASON_CHANGING = "changing"
+REASON_IDLE = "idle"
+REASON_CONGESTED = "congested"
+
+HOLD = 1.0               # seconds at full rate after the last change
+BACKOFF = 1.5            # interval growth per steady message
+OUT_WAITING_HIGH = 1024  # bytes in the OS transmit buffer that count as congestion
+
+
+class AdaptiveCadence:
+    def __init__(self, min_interval, idle_interval, hold=HOLD, backoff=BACKOFF,
+                 out_waiting_high=OUT_WAITING_HIGH):
+        self.min_interval = min_interval
+        self.idle_interval = idle_interval
+        self.hold = hold
+        self.backoff = backoff
+        self.out_waiting_high = out_waiting_high
+
+        self.interval = min_interval
+        self.reason = REASON_CHANGING
+        self._last_msg = None
+        self._last_change = None
+        self._since = time.monotonic()
+
+        self.decisions = {REASON_CHANGING: 0, REASON_IDLE: 0, REASON_CONGESTED: 0}
+        self.time_in = {REASON_CHANGING: 0.0, REASON_IDLE: 0.0, REASON_CONGESTED: 0.0}
+
+    def reset(self):
+        """Back to full rate, e.g. after a reconnect."""
+        self._last_msg = None
+        self._last_change = None
+        self._set(self.min_interval, REASON_CHANGING, time.monotonic())
+
+    def _set(self, interval, reason, now):
+        self.time_in[self.reason] += now - self._since
+        self._since = now
+        self.interval = interval
+        self.reason = reason
+        self.decisions[reason] += 1
+
+    def next_interval(self, msg, out_waiting=0, queued=0, now=None):
+        """msg is the full message just built (before any delta encoding), None if skipped."""
+        now = time.monotonic() if now is None else now
+        if msg is not None and msg != self._last_msg:
+            self._last_msg = msg
+            self._last_change = now
+
+        if out_waiting > self.out_waiting_high or queued:
+            self._set(min(self.interval * 2, self.idle_interval), REASON_CONGESTED, now)
+        elif self._last_change is not None and now - self._last_change < self.hold:
+            self._set(self.min_interval, REASON_CHANGING, now)
+        else:
+            self._set(min(self.interval * self.backoff, self.idle_interval), REASON_IDLE, now)
+        return self.interval
+
+    def stats(self):
+        time_in = dict(self.time_in)
+        time_in[self.reason] += time.monotonic() - self._since
+        return {
+            "interval_ms": self.interval * 1000,
+            "reason": self.reason,
+            "decisions": dict(self.decisions),
+            "seconds_in": {reason: round(t, 3) for reason, t in time_in.items()},
+        }
@@ -0,0 +1,226 @@
+import os
+import sys
+import time
+import struct
+import logging
+import threading
+
+from protocol import PROTOCOL_JSON, get_codec
+
+log = logging.getLogger(__name__)
+
+# -----------------------------
+# Serial capture and replay
+# -----------------------------
+# A capture file is MAGIC followed by records of
+#   RECORD header: t (u64 ns since the capture started, monotonic clock),
+#                  direction (u8), length (u32), then length bytes
+# DIR_HOST  bytes the host wrote, DIR_BOARD  bytes the host read,
+# DIR_NOTE  text events such as the negotiated protocol ("protocol bin1").
+# CapturePort wraps the port main.py opens, so the handshake, every write
+# from the SerialWriter and every engine read are recorded at one place.
+#
+# python capture.py dump FILE            list the records
+# python capture.py replay FILE [--realtime] [--handle]
+#                                        feed the board side through the decoder,
+#                                        --handle also through main.handle_message
+#                                        with the OS backends recorded (bench.py)
+# python capture.py pty FILE [--fast]    play the board side on a pty for the host
+
+MAGIC = b"PCSCAP1\n"
+RECORD = struct.Struct("<QBI")
+
+DIR_HOST = 0
+DIR_BOARD = 1
+DIR_NOTE = 2
+DIR_NAMES = {DIR_HOST: "host", DIR_BOARD: "board", DIR_NOTE: "note"}
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._lock = threading.Lock()
+        self._start = time.monotonic_ns()
+        self.records = 0
+        self.bytes = 0
+
+    def record(self, direction, data):
+        if not data:
+            return
+        t = time.monotonic_ns() - self._start
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(RECORD.pack(t, direction, len(data)))
+            self._file.write(data)
+            self.records += 1
+            self.bytes += len(data)
+
+    def note(self, text):
+        self.record(DIR_NOTE, text.encode())
+
+    def close(self):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.close()
+            self._file = None
+        log.info("Captured %d records (%d bytes) to %s", self.records, self.bytes, self.path)
+
+
+class CapturePort:
+    """Port wrapper that records every read and write, the rest passes through."""
+
+    def __init__(self, port, capture):
+        self._port = port
+        self.capture = capture
+
+    def write(self, data):
+        written = self._port.write(data)
+        self.capture.record(DIR_HOST, bytes(data))
+        return written
+
+    def read(self, size=1):
+        data = self._port.read(size)
+        self.capture.record(DIR_BOARD, data)
+        return data
+
+    def read_all(self):
+        data = self._port.read_all()
+        self.capture.record(DIR_BOARD, data)
+        return data
+
+    def read_until(self, *args, **kwargs):
+        data = self._port.read_until(*args, **kwargs)
+        self.capture.record(DIR_BOARD, data)
+        return data
+
+    def close(self):
+        self._port.close()
+        self.capture.close()
+
+    def __getattr__(self, name):
+        return getattr(self._port, name)
+
+
+def read_capture(path):
+    """Yields (seconds, direction, data) records of a capture file."""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a serial capture")
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return  # end, or a record cut off by a crash
+            t, direction, length = RECORD.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield t / 1e9, direction, data
+
+
+def capture_protocol(path):
+    """The protocol noted in the capture, None when there is no note."""
+    for _, direction, data in read_capture(path):
+        if direction == DIR_NOTE and data.startswith(b"protocol "):
+            return data.split(b" ", 1)[1].decode()
+    return None
+
+
+def _pace(start, t, realtime):
+    if realtime:
+        delay = start + t - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+# ------------ Replay ------------
+
+
+def replay_reads(path, on_message=None, realtime=False):
+    """
+    Feed the board side of a capture through the decoder of its protocol,
+    calling on_message(msg) for every message. Bytes from before the
+    handshake finished (the noted protocol) are skipped.
+    Returns throughput stats of the decode (+ on_message) path.
+    """
+    protocol = capture_protocol(path)
+    streaming = protocol is None  # no note: decode everything as JSON
+    protocol = protocol or PROTOCOL_JSON
+    decoder = get_codec(protocol).decoder(max_errors=sys.maxsize)
+    messages = size = 0
+    busy = 0.0
+    start = time.monotonic()
+    for t, direction, data in read_capture(path):
+        if direction == DIR_NOTE:
+            streaming = streaming or data.startswith(b"protocol ")
+            continue
+        if direction != DIR_BOARD or not streaming:
+            continue
+        _pace(start, t, realtime)
+        began = time.perf_counter()
+        for msg in decoder.feed(data):
+            messages += 1
+            if on_message is not None:
+                on_message(msg)
+        busy += time.perf_counter() - began
+        size += len(data)
+    return {
+        "protocol": protocol,
+        "messages": messages,
+        "bytes": size,
+        "busy_s": busy,
+        "msgs_per_s": messages / busy if busy else 0.0,
+        "mb_per_s": size / busy / 1e6 if busy else 0.0,
+        "decoder": decoder.stats(),
+    }
+
+
+def play_board(path, port, realtime=True):
+    """Write the board side of a capture to port (the board end of a pty)."""
+    start = time.monotonic()
+    for t, direction, data in read_capture(path):
+        if direction == DIR_BOARD:
+            _pace(start, t, realtime)
+            port.write(data)
+
+
+def _dump(path):
+    for t, direction, data in read_capture(path):
+        print(f"{t:10.6f} {DIR_NAMES.get(direction, direction):5} {len(data):5} {data[:60]!r}")
+
+
+def main(args):
+    if len(args) < 2 or args[0] not in ("dump", "replay", "pty"):
+        print("usage: capture.py dump|replay|pty FILE [--realtime|--fast|--handle]")
+        return
+    command, path = args[0], args[1]
+    if command == "dump":
+        _dump(path)
+    elif command == "replay" and "--handle" in args:
+        from bench import replay_handled
+        for key, value in replay_handled(path, realtime="--realtime" in args).items():
+            print(f"{key}: {value}")
+    elif command == "replay":
+        kinds = {}
+
+        def count(msg):
+            key = next(iter(msg), "?") if isinstance(msg, dict) else type(msg).__name__
+            kinds[key] = kinds.get(key, 0) + 1
+        result = replay_reads(path, count, realtime="--realtime" in args)
+        for key, value in result.items():
+            print(f"{key}: {value}")
+        print(f"messages by key: {kinds}")
+    else:
+        from fake_device import FdPort, open_pty_pair
+        master, slave, pty_path = open_pty_pair()
+        print(f"board side of {path} on {pty_path}, press enter once the host opened it")
+        input()
+        os.close(slave)
+        play_board(path, FdPort(master), realtime="--fast" not in args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,50 @@
+import time
+
+# seconds between full keyframes in delta mode
+KEYFRAME_INTERVAL = 10
+
+
+class DeltaEncoder:
+    """
+    Tracks the last state sent on one telemetry stream and only passes on the
+    keys that changed since then. A full keyframe is sent every
+    keyframe_interval seconds and after reset() (reconnect / board asked for it).
+    """
+
+    def __init__(self, keyframe_interval=KEYFRAME_INTERVAL):
+        self.keyframe_interval = keyframe_interval
+        self.last_sent = {}
+        self.last_keyframe = None
+        self.keyframes = 0
+        self.deltas = 0
+        self.skipped = 0
+
+    def reset(self):
+        self.last_sent = {}
+        self.last_keyframe = None
+
+    def encode(self, msg):
+        """Returns the dict to send, or None when nothing changed."""
+        now = time.monotonic()
+        if self.last_keyframe is None or now - self.last_keyframe >= self.keyframe_interval:
+            self.last_keyframe = now
+            self.last_sent = dict(msg)
+            self.keyframes += 1
+            return dict(msg)
+
+        changed = {key: value for key, value in msg.items()
+                   if key not in self.last_sent or self.last_sent[key] != value}
+        if not changed:
+            self.skipped += 1
+            return None
+
+        self.last_sent.update(changed)
+        self.deltas += 1
+        return changed
+
+    def stats(self):
+        return {
+            "keyframes": self.keyframes,
+            "deltas": self.deltas,
+            "skipped": self.skipped,
+        }
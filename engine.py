@@ -0,0 +1,238 @@
+import logging
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import metrics
+from protocol import MAX_ERRORS
+from serial_writer import SerialWriter, PRIORITY_FAST, PRIORITY_NAMES
+from globals import board_is_connected
+
+log = logging.getLogger(__name__)
+
+EXECUTOR_WORKERS = 6
+BUILD_SECONDS = metrics.histogram("build_seconds", "Time to build a periodic message", ("sender",))
+DECODE_SECONDS = metrics.histogram("decode_seconds", "Time to parse one read from the port")
+HANDLE_SECONDS = metrics.histogram("handle_seconds", "Time to handle one board message")
+MESSAGES_RECEIVED = metrics.counter("messages_received_total", "Messages decoded from the board")
+READ_BYTES = metrics.counter("serial_bytes_read_total", "Bytes read from the port")
+
+PAUSED_CHECK = 1.0  # seconds between checks of a paused periodic sender
+
+
+class SerialEngine:
+    """
+    asyncio engine that owns one connected port.
+    - the read loop awaits incoming bytes (the blocking read sits in an
+      executor thread, waiting in the driver instead of polling in_waiting)
+      and splits every complete message out of them with a StreamDecoder
+    - periodic senders run on fixed schedules registered with every()
+    - blocking calls (psutil, sbc, pycaw, actions) run in the executor
+    - all writes go through one SerialWriter thread
+    """
+
+    def __init__(self, port, codec, on_message, thread_init=None, workers=EXECUTOR_WORKERS,
+                 max_errors=MAX_ERRORS):
+        self.port = port
+        self.codec = codec
+        self.on_message = on_message
+        self.decoder = codec.decoder(max_errors)
+        self.writer = SerialWriter(port)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="engine", initializer=thread_init)
+        self._periodic = []
+        self._background = []
+        self._loop = None
+        self._wake = None
+        self.received_at = 0.0  # time.monotonic() when the message being handled arrived
+        self.end_reason = None
+        self.handler_errors = 0
+        self.build_errors = {}  # sender -> failed builds
+        self._stop_callbacks = []
+
+    def every(self, interval, build, priority, delta=None, cadence=None, paused=None):
+        """
+        Send build() every interval seconds, optionally through a DeltaEncoder.
+        interval may be a function returning the current interval. With an
+        AdaptiveCadence the interval is chosen per message instead. Nothing
+        is sent while paused() is true, wake() ends the wait early.
+        """
+        self._periodic.append((interval, build, priority, delta, cadence, paused))
+
+    def after_start(self, func, *args):
+        """Run func(engine, *args) in the executor once the session is up."""
+        self._background.append((func, args))
+
+    def on_stop(self, func):
+        """Call func() once when the session ends, to wake workers waiting on the board."""
+        self._stop_callbacks.append(func)
+
+    def push(self, msg, priority):
+        """Encode and queue a message, safe to call from any thread."""
+        self.writer.submit(self.codec.encode(msg), priority)
+
+    def wake(self):
+        """Re-check paused senders now, safe to call from any thread."""
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    async def _pause(self, timeout):
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run_blocking(self, func, *args):
+        return await self._loop.run_in_executor(self.executor, func, *args)
+
+    def _out_waiting(self):
+        try:
+            return self.port.out_waiting
+        except (AttributeError, OSError):
+            return 0
+
+    def _timed_build(self, build, build_seconds):
+        with build_seconds.time():
+            return build()
+
+    def _handle(self, msg):
+        # one bad message must not end the session
+        try:
+            with HANDLE_SECONDS.time():
+                self.on_message(self, msg)
+        except Exception:
+            self.handler_errors += 1
+            log.exception("Failed to handle %r", msg)
+
+    def stop(self, reason):
+        """End the session, the first reason given is kept."""
+        board_is_connected.clear()
+        if self.end_reason is not None:
+            return
+        self.end_reason = reason
+        for func in self._stop_callbacks:
+            try:
+                func()
+            except Exception:
+                log.exception("Stop callback failed")
+
+    async def _build(self, build, build_seconds, name, failing):
+        # a sensor that raises (no DDC monitor, no audio endpoint) skips this
+        # cycle instead of ending the session, only the link errors do that
+        try:
+            full = await self.run_blocking(self._timed_build, build, build_seconds)
+        except Exception:
+            self.build_errors[name] = self.build_errors.get(name, 0) + 1
+            if not failing:
+                log.exception("Building the %s message failed, skipping it while it fails", name)
+            return None, True
+        if failing:
+            log.info("Building the %s message works again", name)
+        return full, False
+
+    async def _periodic_loop(self, interval, build, priority, delta, cadence, paused):
+        name = PRIORITY_NAMES[priority]
+        build_seconds = BUILD_SECONDS.labels(name)
+        failing = False
+        next_run = self._loop.time()
+        while board_is_connected.is_set():
+            if paused is not None and paused():
+                await self._pause(PAUSED_CHECK)
+                next_run = self._loop.time()
+                continue
+
+            queued = self.writer.pending(priority)
+            full = None
+            # latest value wins, don't stack fast frames behind a busy link
+            if not (priority == PRIORITY_FAST and queued):
+                full, failing = await self._build(build, build_seconds, name, failing)
+                if full is not None:
+                    msg = delta.encode(full) if delta is not None else full
+                    if msg:
+                        self.writer.submit(self.codec.encode(msg), priority)
+
+            if cadence is not None:
+                delay = cadence.next_interval(full, self._out_waiting(), queued)
+            else:
+                delay = interval() if callable(interval) else interval
+            next_run += delay
+            delay = next_run - self._loop.time()
+            if delay < 0:
+                # fell behind, restart the schedule instead of bursting
+                next_run = self._loop.time()
+                delay = 0
+            await asyncio.sleep(delay)
+
+    def _read_available(self):
+        # blocks in the driver until at least one byte or the port timeout,
+        # then takes everything that arrived with it
+        return self.port.read(max(1, self.port.in_waiting))
+
+    async def _read_loop(self):
+        while board_is_connected.is_set():
+            try:
+                data = await self.run_blocking(self._read_available)
+                received_at = time.monotonic()
+                messages = []
+                if data:
+                    READ_BYTES.inc(len(data))
+                    with DECODE_SECONDS.time():
+                        messages = self.decoder.feed(data)
+                    MESSAGES_RECEIVED.inc(len(messages))
+            except ValueError as e:
+                log.error("Too many invalid messages, dropping link: %s", e)
+                self.stop("invalid messages")
+                return
+            except OSError as e:
+                log.error("Serial read error: %s", e)
+                self.stop("read error")
+                return
+            for msg in messages:
+                self.received_at = received_at
+                await self.run_blocking(self._handle, msg)
+
+    async def run(self):
+        """
+        Runs the workers (read loop, periodic senders, writer thread) until
+        the first one ends: a read or write error, a sender that raised, or
+        board_is_connected cleared from outside. Then every worker is
+        cancelled and joined before returning; end_reason says why.
+        """
+        self._loop = asyncio.get_running_loop()
+        writer_done = self._loop.create_future()
+
+        def run_writer():
+            self.writer.run()
+            self._loop.call_soon_threadsafe(
+                lambda: writer_done.done() or writer_done.set_result(None))
+
+        writer_thread = threading.Thread(target=run_writer, name="serial-writer", daemon=True)
+        writer_thread.start()
+
+        tasks = [asyncio.create_task(self._read_loop(), name="read")]
+        self._wake = asyncio.Event()
+        for periodic in self._periodic:
+            tasks.append(asyncio.create_task(
+                self._periodic_loop(*periodic), name=f"send-{PRIORITY_NAMES[periodic[2]]}"))
+        for func, args in self._background:
+            # not awaited with the loops, a slow one-off job must not end the session
+            self._loop.run_in_executor(self.executor, func, self, *args)
+        try:
+            done, _ = await asyncio.wait(tasks + [writer_done], return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is writer_done:
+                    self.stop("write error" if self.writer.error else "writer stopped")
+                elif task.exception() is not None:
+                    log.error("Worker %s failed", task.get_name(), exc_info=task.exception())
+                    self.stop(f"{task.get_name()} failed: {task.exception()!r}")
+            self.stop("disconnected")
+        finally:
+            board_is_connected.clear()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.writer.stop()
+            writer_thread.join()
+            self.executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,286 @@
+import os
+import zlib
+import time
+import random
+import fcntl
+import select
+import struct
+import termios
+import threading
+
+from protocol import PROTOCOL_JSON, PROTOCOL_BINARY, get_codec
+from icon_transfer import ENC_RLE, rle_decode
+
+# -----------------------------
+# Stand-in for the ESP32 board
+# -----------------------------
+# Runs the board side of the link on the master end of a pty pair, so the
+# host code can open the slave end like a real serial port (Linux only).
+
+
+# what an ESP32 prints after a reset, before the firmware listens
+BOOT_BANNER = (b"ets Jul 29 2019 12:21:46\r\n\r\nrst:0x1 (POWERON_RESET),boot:0x13 (SPI_FAST_FLASH_BOOT)\r\n"
+               b"load:0x3fff0030,len:1344\r\nentry 0x400805f0\r\n")
+
+
+class FdPort:
+    """Minimal pyserial-like wrapper around a file descriptor."""
+
+    def __init__(self, fd, timeout=2):
+        self.fd = fd
+        self.timeout = timeout
+
+    @property
+    def in_waiting(self):
+        buf = fcntl.ioctl(self.fd, termios.FIONREAD, b"\0\0\0\0")
+        return struct.unpack("I", buf)[0]
+
+    @property
+    def out_waiting(self):
+        buf = fcntl.ioctl(self.fd, termios.TIOCOUTQ, b"\0\0\0\0")
+        return struct.unpack("I", buf)[0]
+
+    def read(self, size=1):
+        data = bytearray()
+        deadline = time.monotonic() + self.timeout
+        while len(data) < size:
+            left = deadline - time.monotonic()
+            if left <= 0 or not select.select([self.fd], [], [], left)[0]:
+                break
+            data += os.read(self.fd, size - len(data))
+        return bytes(data)
+
+    def read_until(self, expected=b"\n"):
+        data = bytearray()
+        while not data.endswith(expected):
+            byte = self.read(1)
+            if not byte:
+                break
+            data += byte
+        return bytes(data)
+
+    def read_all(self):
+        waiting = self.in_waiting
+        return os.read(self.fd, waiting) if waiting else b""
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        os.close(self.fd)
+
+
+def open_pty_pair():
+    """
+    Returns (master fd, slave fd, slave path) with the slave in raw mode.
+    Keep the slave fd open until the host has opened the path, the master
+    reads EIO while no slave is open.
+    """
+    master, slave = os.openpty()
+    attrs = termios.tcgetattr(slave)
+    attrs[0] = 0                                   # iflag
+    attrs[1] = 0                                   # oflag
+    attrs[3] = 0                                   # lflag
+    attrs[6][termios.VMIN] = 1
+    attrs[6][termios.VTIME] = 0
+    termios.tcsetattr(slave, termios.TCSANOW, attrs)
+    return master, slave, os.ttyname(slave)
+
+
+class FakeDevice:
+    """
+    Answers the handshake, records every message the host sends and receives
+    offered icons (legacy raw chunks or the windowed transfer).
+    drop_rate drops that share of windowed chunks to exercise retransmission.
+    play() sends scripted board input (sliders, commands, noise) meanwhile.
+    boot_delay > 0 acts like a board reset by the port being opened: a boot
+    banner, then everything the host sends during boot_delay is lost.
+    """
+
+    def __init__(self, port, supports_binary=True, accept_icons=True, drop_rate=0.0, seed=None,
+                 boot_delay=0.0):
+        self.port = port
+        self.boot_delay = boot_delay
+        self.supports_binary = supports_binary
+        self.accept_icons = accept_icons
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.codec = get_codec(PROTOCOL_JSON)
+        self.received = []
+        self.raw_bytes = 0
+        self.icons = {}       # name -> decoded .bin
+        self.bad_icons = []
+        self._icon = None     # transfer in progress
+        self._stop = threading.Event()
+        self._write_lock = threading.Lock()
+        self.connected = threading.Event()
+        self.connected_at = None  # time.monotonic() of the handshake answer
+        self.sent_log = []    # (time.monotonic(), msg) of every scripted message
+        self.noise_bytes = 0
+
+    def boot(self):
+        self.port.write(BOOT_BANNER)
+        time.sleep(self.boot_delay)
+        self.port.read_all()
+
+    def handshake(self, timeout=5):
+        if self.boot_delay:
+            self.boot()
+        data = b""
+        deadline = time.monotonic() + timeout
+        while b"host_ok" not in data and time.monotonic() < deadline:
+            data += self.port.read(1)
+        if b"host_ok" not in data:
+            return False
+        time.sleep(0.05)  # let the rest of the hello arrive
+        data += self.port.read_all()
+
+        if self.supports_binary and PROTOCOL_BINARY.encode() in data:
+            self.codec = get_codec(PROTOCOL_BINARY)
+            self.port.write(b"ESP32_ok " + PROTOCOL_BINARY.encode())
+        else:
+            self.port.write(b"ESP32_ok")
+        self.connected_at = time.monotonic()
+        self.connected.set()
+        return True
+
+    def send(self, msg):
+        data = self.codec.encode(msg)
+        with self._write_lock:
+            self.port.write(data)
+
+    def read_message(self):
+        try:
+            msg = self.codec.read_message(self.port)
+        except ValueError as e:
+            print("fake device: invalid message:", e)
+            return None
+        if isinstance(msg, bytes):
+            self.raw_bytes += len(msg)
+            if self._icon is not None:
+                self._icon["data"] += msg
+        elif isinstance(msg, dict) and "seq" in msg:
+            self._on_chunk(msg)
+        elif msg is not None:
+            self.received.append(msg)
+            self._on_message(msg)
+        return msg
+
+    def _on_message(self, msg):
+        if not isinstance(msg, dict):
+            return
+        if "inventory" in msg:
+            self.send({"inventory": [[name, zlib.crc32(data)]
+                                     for name, data in self.icons.items()]})
+        elif "delete_app" in msg:
+            self.icons.pop(msg["delete_app"], None)
+        elif "new_app" in msg and self.accept_icons:
+            self._icon = {"offer": msg, "data": bytearray(), "next": 0}
+            self.send({"waiting_for_icon": True})
+            if self.codec.name == PROTOCOL_JSON:
+                # legacy transfer: raw bytes right after the request
+                data = self.port.read(msg["size"])
+                self.raw_bytes += len(data)
+                self._icon["data"] += data
+        elif "done" in msg and self._icon is not None:
+            self._finish_icon()
+
+    def _on_chunk(self, msg):
+        icon = self._icon
+        if icon is None:
+            return
+        if self.drop_rate and self.random.random() < self.drop_rate:
+            return
+        if msg["seq"] == icon["next"]:
+            icon["data"] += msg["chunk"]
+            icon["next"] += 1
+        self.raw_bytes += len(msg["chunk"])
+        self.send({"ack": icon["next"]})
+
+    def _finish_icon(self):
+        offer = self._icon["offer"]
+        data = bytes(self._icon["data"])
+        self._icon = None
+        if offer.get("enc") == ENC_RLE:
+            data = rle_decode(data, offer["size"])
+        if len(data) == offer["size"] and zlib.crc32(data) == offer["crc"]:
+            self.icons[offer["new_app"]] = data
+        else:
+            print(f"fake device: bad icon {offer['new_app']}")
+            self.bad_icons.append(offer["new_app"])
+
+    def run(self):
+        if not self.handshake():
+            print("fake device: no handshake")
+            return
+        while not self._stop.is_set():
+            try:
+                self.read_message()
+            except OSError:
+                # host closed its end
+                return
+
+    def stop(self):
+        self._stop.set()
+
+    # ------------ Scripted board input ------------
+    # A script is a list of steps:
+    #   ("wait", seconds)
+    #   ("slider", key, values, interval)     {key: value} for each value, e.g. setVolume
+    #   ("command", name, count, interval)    {"command": name}, count times
+    #   ("noise", nbytes)                     random bytes and a newline
+    #   ("keyframe",)                         ask for full telemetry
+
+    def _scripted(self, msg):
+        self.sent_log.append((time.monotonic(), msg))
+        self.send(msg)
+
+    def play(self, script, timeout=5):
+        """Run the script once the handshake is done, returns False without one."""
+        if not self.connected.wait(timeout):
+            return False
+        for step in script:
+            if self._stop.is_set():
+                break
+            kind, args = step[0], step[1:]
+            if kind == "wait":
+                time.sleep(args[0])
+            elif kind == "slider":
+                key, values, interval = args
+                for value in values:
+                    self._scripted({key: value})
+                    time.sleep(interval)
+            elif kind == "command":
+                name, count, interval = args
+                for _ in range(count):
+                    self._scripted({"command": name})
+                    time.sleep(interval)
+            elif kind == "noise":
+                # no newline or sync bytes inside, so it costs the host one resync
+                noise = bytes(self.random.choice(range(0x20, 0x7B)) for _ in range(args[0]))
+                with self._write_lock:
+                    self.port.write(noise + b"\n")
+                self.noise_bytes += len(noise) + 1
+            elif kind == "keyframe":
+                self._scripted({"keyframe": True})
+            else:
+                raise ValueError(f"unknown script step {kind!r}")
+        return True
+
+
+if __name__ == "__main__":
+    master, _, path = open_pty_pair()
+    print(f"fake board listening on {path}")
+    device = FakeDevice(FdPort(master))
+    try:
+        device.run()
+    except KeyboardInterrupt:
+        pass
+    print(f"received {len(device.received)} messages, {device.raw_bytes} raw bytes")
@@ -3,3 +3,5 @@ import threading
 
 new_app_detected = threading.Event()
 board_is_connected = threading.Event()
+icon_requested = threading.Event()
+inventory_received = threading.Event()
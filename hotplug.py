@@ -0,0 +1,208 @@
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import logging
+import threading
+
+import serial.tools.list_ports
+
+log = logging.getLogger(__name__)
+
+# -----------------------------
+# Serial device discovery
+# -----------------------------
+# Waits for the board's serial port to show up, matched by USB VID/PID.
+# Ports are only enumerated when the OS says a device changed:
+# - Linux: an inotify watch on /dev, woken when a tty node is created or
+#   udev changes its permissions
+# - Windows: a hidden window receiving the WM_DEVICECHANGE broadcasts
+# Without either (other platforms, or the setup failed) the ports are
+# enumerated every HOTPLUG_POLL_INTERVAL seconds, as often as the old loop.
+
+HOTPLUG_POLL_INTERVAL = 0.7  # seconds between enumerations without notifications
+DEV_DIR = "/dev"
+TTY_PREFIXES = ("tty", "cu.")  # device nodes worth enumerating for
+
+_IN_NONBLOCK = os.O_NONBLOCK
+_IN_CLOEXEC = 0o2000000
+_IN_ATTRIB = 0x004
+_IN_CREATE = 0x100
+_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len, then len bytes of name
+
+
+class _Inotify:
+    """Watch of one directory for created / changed entries (Linux only)."""
+
+    def __init__(self, path):
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, path.encode(), _IN_CREATE | _IN_ATTRIB) < 0:
+            err = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(err, f"inotify_add_watch {path} failed")
+
+    def wait(self, timeout):
+        """True once a tty node changed, False after timeout seconds."""
+        deadline = time.monotonic() + timeout
+        while True:
+            names = self.names(max(0.0, deadline - time.monotonic()))
+            if any(name.startswith(TTY_PREFIXES) for name in names):
+                return True
+            if time.monotonic() >= deadline:
+                return False
+
+    def names(self, timeout):
+        """Names of the entries that changed within timeout seconds, [] on timeout."""
+        if not select.select([self.fd], [], [], timeout)[0]:
+            return []
+        try:
+            buf = os.read(self.fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return []
+            raise
+        names = []
+        offset = 0
+        while offset + _EVENT.size <= len(buf):
+            _, _, _, length = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            names.append(buf[offset:offset + length].rstrip(b"\0").decode(errors="replace"))
+            offset += length
+        return names
+
+    def close(self):
+        os.close(self.fd)
+
+
+_WM_DEVICECHANGE = 0x0219
+_DBT_DEVNODES_CHANGED = 0x0007
+_DBT_DEVICEARRIVAL = 0x8000
+
+
+class _DeviceChangeWindow:
+    """Hidden top-level window that gets the WM_DEVICECHANGE broadcasts (Windows only)."""
+
+    def __init__(self):
+        import win32api
+        import win32gui
+        self._win32gui = win32gui
+        self._changed = threading.Event()
+        self._ready = threading.Event()
+        self.hwnd = None
+        self.error = None
+
+        wc = win32gui.WNDCLASS()
+        wc.lpszClassName = "PCStatsDeviceChange"
+        wc.hInstance = win32api.GetModuleHandle(None)
+        wc.lpfnWndProc = {_WM_DEVICECHANGE: self._on_device_change}
+        self._class = win32gui.RegisterClass(wc)
+        self._instance = wc.hInstance
+
+        threading.Thread(target=self._run, name="device-change", daemon=True).start()
+        self._ready.wait()
+        if self.hwnd is None:
+            raise OSError(f"device change window failed: {self.error}")
+
+    def _run(self):
+        # the window belongs to this thread, which pumps its messages
+        try:
+            self.hwnd = self._win32gui.CreateWindow(
+                self._class, "PC stats device change", 0, 0, 0, 0, 0, 0, 0, self._instance, None)
+        except Exception as e:
+            self.error = e
+        self._ready.set()
+        if self.hwnd is not None:
+            self._win32gui.PumpMessages()
+
+    def _on_device_change(self, hwnd, msg, wparam, lparam):
+        if wparam in (_DBT_DEVICEARRIVAL, _DBT_DEVNODES_CHANGED):
+            self._changed.set()
+        return True
+
+    def wait(self, timeout):
+        """True once a device arrived or the device tree changed, False after timeout seconds."""
+        changed = self._changed.wait(timeout)
+        self._changed.clear()
+        return changed
+
+    def close(self):
+        if self.hwnd is not None:
+            self._win32gui.PostMessage(self.hwnd, 0x0010, 0, 0)  # WM_CLOSE
+            self.hwnd = None
+
+
+class DeviceWatcher:
+    """
+    wait() returns the matching port (a list_ports entry) once it is present.
+    appeared_at is the time.monotonic() when the port was last seen appearing.
+    """
+
+    def __init__(self, vid, pid, poll_interval=HOTPLUG_POLL_INTERVAL):
+        self.vid = vid
+        self.pid = pid
+        self.poll_interval = poll_interval
+        self.appeared_at = None
+        self._present = False
+        self._notifier = None
+        self.backend = "poll"
+        if sys.platform.startswith("linux"):
+            try:
+                self._notifier = _Inotify(DEV_DIR)
+                self.backend = "inotify"
+            except (OSError, AttributeError) as e:
+                log.warning("No inotify on %s, polling for the device: %s", DEV_DIR, e)
+        elif sys.platform == "win32":
+            try:
+                self._notifier = _DeviceChangeWindow()
+                self.backend = "wm_devicechange"
+            except Exception as e:
+                log.warning("No device change notifications, polling for the device: %s", e)
+
+        self.scans = 0
+        self.events = 0
+
+    def find(self):
+        """The matching port if it is present now, else None."""
+        self.scans += 1
+        for port in serial.tools.list_ports.comports():
+            if port.vid == self.vid and port.pid == self.pid:
+                if not self._present:
+                    self._present = True
+                    self.appeared_at = time.monotonic()
+                    log.info("Found board on %s", port.device)
+                return port
+        self._present = False
+        return None
+
+    def wait_change(self, timeout):
+        """Block until a serial device may have changed, or timeout seconds."""
+        if self._notifier is None:
+            time.sleep(min(timeout, self.poll_interval))
+        elif self._notifier.wait(timeout):
+            self.events += 1
+
+    def wait(self, timeout=None):
+        """The matching port once present, None after timeout seconds (None waits forever)."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            port = self.find()
+            if port is not None:
+                return port
+            left = 3600.0 if deadline is None else deadline - time.monotonic()
+            if left <= 0:
+                return None
+            self.wait_change(left)
+
+    def close(self):
+        if self._notifier is not None:
+            self._notifier.close()
+            self._notifier = None
+
+    def stats(self):
+        return {"backend": self.backend, "scans": self.scans, "events": self.events}
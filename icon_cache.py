@@ -0,0 +1,122 @@
+import logging
+import os
+import json
+import shutil
+import threading
+
+log = logging.getLogger(__name__)
+
+ICON_CACHE_INDEX = "icon_cache.json"
+MAX_PID_COPIES = 32  # debug {name}_{pid}.png copies kept on disk
+
+
+class IconCache:
+    """
+    Remembers which PNG / .bin files were produced for an executable, keyed by
+    (exe path, size, mtime). A known exe skips icoextract and the conversion.
+    The outputs are name keyed files that another exe with the same name can
+    overwrite, so an entry also records their size / mtime and is only a hit
+    while the files are still the ones it stored.
+    Also keeps the per-PID debug PNG copies bounded with LRU eviction.
+    """
+
+    def __init__(self, index_path=ICON_CACHE_INDEX, max_pid_copies=MAX_PID_COPIES):
+        self.index_path = index_path
+        self.max_pid_copies = max_pid_copies
+        self._lock = threading.Lock()
+
+        self.entries = {}
+        self.pid_copies = []  # oldest first
+        self._load()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _load(self):
+        if not os.path.exists(self.index_path):
+            return
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.entries = data.get("entries", {})
+            self.pid_copies = data.get("pid_copies", [])
+        except (OSError, ValueError) as e:
+            log.warning("Ignoring broken icon cache index: %s", e)
+
+    def _save(self):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"entries": self.entries, "pid_copies": self.pid_copies}, f)
+        os.replace(tmp_path, self.index_path)
+
+    @staticmethod
+    def key(exe_path):
+        st = os.stat(exe_path)
+        return f"{os.path.normcase(os.path.abspath(exe_path))}|{st.st_size}|{st.st_mtime_ns}"
+
+    @staticmethod
+    def _stamp(path):
+        st = os.stat(path)
+        return [st.st_size, st.st_mtime_ns]
+
+    def _intact(self, entry):
+        try:
+            return entry.get("stamps") == {"png": self._stamp(entry["png"]),
+                                           "bin": self._stamp(entry["bin"])}
+        except OSError:
+            return False
+
+    def lookup(self, exe_path):
+        """Return {"png": path, "bin": path, "info": manifest fields} for a known exe, or None."""
+        try:
+            key = self.key(exe_path)
+        except OSError:
+            key = None
+        with self._lock:
+            entry = self.entries.get(key) if key else None
+            if entry and self._intact(entry):
+                self.hits += 1
+                return dict(entry)
+            self.misses += 1
+            return None
+
+    def store(self, exe_path, png_path, bin_path, info=None):
+        try:
+            key = self.key(exe_path)
+            stamps = {"png": self._stamp(png_path), "bin": self._stamp(bin_path)}
+        except OSError:
+            return
+        with self._lock:
+            # one entry per exe, drop the ones for older builds
+            prefix = key.rsplit("|", 2)[0] + "|"
+            for old in [k for k in self.entries if k.startswith(prefix)]:
+                del self.entries[old]
+            self.entries[key] = {"png": png_path, "bin": bin_path, "info": info, "stamps": stamps}
+            self._save()
+
+    def save_pid_copy(self, png_path, pid_png_path):
+        """Copy the app PNG to its per-PID debug name, evicting the oldest copies."""
+        shutil.copyfile(png_path, pid_png_path)
+        with self._lock:
+            if pid_png_path in self.pid_copies:
+                self.pid_copies.remove(pid_png_path)
+            self.pid_copies.append(pid_png_path)
+            while len(self.pid_copies) > self.max_pid_copies:
+                old = self.pid_copies.pop(0)
+                try:
+                    os.remove(old)
+                except OSError:
+                    pass
+                self.evictions += 1
+            self._save()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "pid_copies": len(self.pid_copies),
+                "evictions": self.evictions,
+            }
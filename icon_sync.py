@@ -0,0 +1,36 @@
+# -----------------------------
+# Icon inventory sync
+# -----------------------------
+# After the handshake the host asks {"inventory": "?"} and the board answers
+# {"inventory": [[name, crc], ...]} with the icons it has stored. Only the
+# top apps whose icon is missing or has another crc are sent, best score
+# first, and icons outside the top set are deleted with {"delete_app": name}.
+# Boards that do not answer keep their icons as they are.
+
+ICON_SLOTS = 12
+
+
+def parse_inventory(raw):
+    """[[name, crc], ...] from the board -> {name: crc}, bad entries are skipped."""
+    inventory = {}
+    for item in raw or []:
+        try:
+            name, crc = item
+            inventory[str(name)] = int(crc)
+        except (TypeError, ValueError):
+            continue
+    return inventory
+
+
+def plan_icon_sync(inventory, offers, top):
+    """
+    inventory: {name: crc} stored on the board
+    offers:    {name: crc} of the host icons
+    top:       app names ordered by score, best first
+    Returns (names to send in order, names to delete).
+    """
+    top_set = set(top)
+    send = [name for name in top
+            if name in offers and inventory.get(name) != offers[name]]
+    delete = sorted(name for name in inventory if name not in top_set)
+    return send, delete
@@ -0,0 +1,195 @@
+import logging
+import time
+import threading
+
+from lvgl import lvgl_header
+
+log = logging.getLogger(__name__)
+
+# -----------------------------
+# Windowed icon transfer (bin1 only)
+# -----------------------------
+# host  -> offer {"new_app": ..., "size", "crc", "xfer": "win1", "enc", "zsize", "chunks"}
+# board -> {"waiting_for_icon": true}
+# host  -> FRAME_CHUNK seq 0..n-1, at most WINDOW chunks unacknowledged
+# board -> {"ack": next expected seq} (cumulative, out of order chunks are dropped)
+# host  -> {"done": "done"} once every chunk is acknowledged
+# size and crc describe the decoded .bin, so the board checks after decoding.
+
+XFER_WINDOWED = "win1"
+ENC_RAW = "raw"
+ENC_RLE = "rle"
+
+CHUNK_SIZE = 512
+WINDOW = 8
+ACK_TIMEOUT = 0.25  # seconds before an unacknowledged chunk is sent again
+MAX_RETRIES = 8     # resends of one chunk before the transfer is given up
+DUP_ACKS = 2        # repeated acks for the same seq that resend it right away
+
+HEADER_SIZE = len(lvgl_header(0, 0))
+
+
+# ------------ RGB565 run length encoding ------------
+# The .bin header is kept as is, the pixels (16 bit words) are packets of
+#   0x80 | (n - 1), pixel        -> n copies of pixel (n <= 128)
+#   n - 1, pixel * n             -> n literal pixels (n <= 128)
+# A trailing odd byte, if any, is appended unchanged.
+
+
+def rle_encode(data):
+    data = bytes(data)
+    out = bytearray(data[:HEADER_SIZE])
+    pixels = data[HEADER_SIZE:]
+    count = len(pixels) // 2
+    literal_start = 0
+    i = 0
+
+    def flush_literals(end):
+        start = literal_start
+        while start < end:
+            n = min(128, end - start)
+            out.append(n - 1)
+            out.extend(pixels[start * 2:(start + n) * 2])
+            start += n
+
+    while i < count:
+        pixel = pixels[i * 2:i * 2 + 2]
+        run = 1
+        while i + run < count and run < 128 and pixels[(i + run) * 2:(i + run) * 2 + 2] == pixel:
+            run += 1
+        if run >= 2:
+            flush_literals(i)
+            out.append(0x80 | (run - 1))
+            out.extend(pixel)
+            i += run
+            literal_start = i
+        else:
+            i += 1
+    flush_literals(count)
+    out.extend(pixels[count * 2:])
+    return bytes(out)
+
+
+def rle_decode(data, size):
+    """size is the decoded length, it tells a trailing odd byte apart from a packet."""
+    data = bytes(data)
+    out = bytearray(data[:HEADER_SIZE])
+    i = HEADER_SIZE
+    pixel_end = HEADER_SIZE + (size - HEADER_SIZE) // 2 * 2
+    while len(out) < pixel_end:
+        head = data[i]
+        n = (head & 0x7F) + 1
+        if head & 0x80:
+            out.extend(data[i + 1:i + 3] * n)
+            i += 3
+        else:
+            out.extend(data[i + 1:i + 1 + n * 2])
+            i += 1 + n * 2
+    out.extend(data[i:])
+    return bytes(out)
+
+
+def encode_payload(icon_data, enc):
+    if enc == ENC_RLE:
+        packed = rle_encode(icon_data)
+        if len(packed) < len(icon_data):
+            return ENC_RLE, packed
+    return ENC_RAW, bytes(icon_data)
+
+
+# ------------ Sender ------------
+
+
+class IconTransfer:
+    """
+    Sends one payload as sequence numbered chunks through send_chunk(seq, data)
+    with at most window chunks in flight. on_ack() is fed the board's
+    cumulative acks (from the read path); chunks that stay unacknowledged for
+    ack_timeout are sent again. abort() ends run() early, e.g. on a disconnect.
+    """
+
+    def __init__(self, payload, send_chunk, chunk_size=CHUNK_SIZE, window=WINDOW,
+                 ack_timeout=ACK_TIMEOUT, max_retries=MAX_RETRIES):
+        self.chunks = [payload[i:i + chunk_size] for i in range(0, len(payload), chunk_size)]
+        self.send_chunk = send_chunk
+        self.window = window
+        self.ack_timeout = ack_timeout
+        self.max_retries = max_retries
+
+        self._cond = threading.Condition()
+        self._acked = 0         # every seq below this is confirmed
+        self._next = 0          # next seq never sent
+        self._sent_at = {}      # seq -> last send time, for chunks in flight
+        self._tries = {}
+        self._dup_acks = 0
+        self._aborted = False
+
+        self.retransmits = 0
+        self.elapsed = 0.0
+
+    def on_ack(self, next_seq):
+        with self._cond:
+            if next_seq > self._acked:
+                for seq in range(self._acked, min(next_seq, self._next)):
+                    self._sent_at.pop(seq, None)
+                self._acked = min(next_seq, len(self.chunks))
+                self._dup_acks = 0
+                self._cond.notify_all()
+            elif next_seq == self._acked and self._acked in self._sent_at:
+                # the board keeps asking for the same chunk, it was lost:
+                # resend it now instead of waiting for the timeout
+                self._dup_acks += 1
+                if self._dup_acks == DUP_ACKS:
+                    self._sent_at[self._acked] = 0.0
+                    self._cond.notify_all()
+
+    def abort(self):
+        with self._cond:
+            self._aborted = True
+            self._cond.notify_all()
+
+    def _send(self, seq):
+        self._sent_at[seq] = time.monotonic()
+        self._tries[seq] = self._tries.get(seq, 0) + 1
+        self.send_chunk(seq, self.chunks[seq])
+
+    def run(self):
+        """Returns True once every chunk is acknowledged."""
+        start = time.monotonic()
+        with self._cond:
+            while self._acked < len(self.chunks):
+                if self._aborted:
+                    log.info("Icon transfer aborted at chunk %d", self._acked)
+                    self.elapsed = time.monotonic() - start
+                    return False
+                while self._next < len(self.chunks) and self._next < self._acked + self.window:
+                    self._send(self._next)
+                    self._next += 1
+
+                now = time.monotonic()
+                expired = [seq for seq, sent in self._sent_at.items()
+                           if now - sent >= self.ack_timeout]
+                for seq in sorted(expired):
+                    if self._tries[seq] > self.max_retries:
+                        log.error("Icon transfer failed at chunk %d", seq)
+                        self.elapsed = time.monotonic() - start
+                        return False
+                    self.retransmits += 1
+                    self._send(seq)
+
+                if self._acked < len(self.chunks):
+                    oldest = min(self._sent_at.values(), default=now)
+                    self._cond.wait(max(0.001, oldest + self.ack_timeout - time.monotonic()))
+
+        self.elapsed = time.monotonic() - start
+        return True
+
+    def stats(self):
+        size = sum(len(chunk) for chunk in self.chunks)
+        return {
+            "chunks": len(self.chunks),
+            "bytes": size,
+            "retransmits": self.retransmits,
+            "elapsed_ms": self.elapsed * 1000,
+            "throughput_kbps": size / self.elapsed / 1024 if self.elapsed else 0.0,
+        }
@@ -1,4 +1,7 @@
+import logging
 import os
+import zlib
+import atexit
 import time
 import psutil
 import getpass
@@ -8,60 +11,81 @@ from PIL import Image
 import subprocess
 import win32gui
 import win32process
-import struct
-from crc import Configuration, Calculator
 from globals import board_is_connected, new_app_detected
+from lvgl import encode_lvgl_bin, encode_lvgl_bins, ICON_SIZE
+from icon_cache import IconCache
+from registry_store import RegistryStore
+from ranking import AppRanking, TOP_K
+from process_watcher import ProcessWatcher
+import metrics
+
+log = logging.getLogger(__name__)
+
+ICON_STAGE_SECONDS = metrics.histogram("icon_stage_seconds", "Time per icon pipeline stage", ("stage",))
+ICON_CACHE_HITS = metrics.counter("icon_cache_hits_total", "Icons served from the icon cache")
 # -----------------------------
 # CONFIG
 # -----------------------------
 OUTPUT_FOLDER = "user_app_icons"
 CHECK_INTERVAL = 5   # seconds
+PENDING_TIMEOUT = 30  # seconds a new process is re-checked every CHECK_INTERVAL for a visible window
+PENDING_RECHECK = 30  # seconds between re-checks after that (tray apps), until the process exits
 
 TEMP_ICON = "temp.ico"
 ICON_PNG_FOLDER = "user_app_icons"
 LVGL_BIN_FOLDER = "lvgl_bin_icons"
 HEIGHT = 100
 WIDTH = 100  # width, height in px
-ICON_SIZE = (100, 100)
-LV_IMG_CF_TRUE_COLOR = 0x02  # RGB565
 APPS_JSON = "apps.json"
+TOP_APPS_JSON = "top_apps.json"
+SAVE_PID_COPIES = True  # keep {name}_{pid}.png debug copies (bounded, see icon_cache.py)
 
 
-config_IEEE = Configuration(
-    width=32,
-    polynomial=0x04C11DB7,
-    init_value=0xFFFFFFFF,
-    final_xor_value=0xFFFFFFFF,
-    reverse_input=True,
-    reverse_output=True,
-)
+# CRC-32 IEEE: width=32, polynomial=0x04C11DB7, init_value=0xFFFFFFFF,
+# final_xor_value=0xFFFFFFFF, reverse_input=True, reverse_output=True.
+# These are zlib.crc32's parameters, so the board check is unchanged.
 
 
 os.makedirs(ICON_PNG_FOLDER, exist_ok=True)
 os.makedirs(LVGL_BIN_FOLDER, exist_ok=True)
 
+icon_cache = IconCache()
+registry_store = RegistryStore(APPS_JSON)
+atexit.register(registry_store.close)
+
+# top_apps.json follows the ranking, it is only rewritten when the top changes
+app_ranking = AppRanking(TOP_K)
+app_ranking.load(registry_store.snapshot())
+app_ranking.add_listener(lambda top: write_top_apps(top))
+
 # -----------------------------
 # Load / Save registry
 # -----------------------------
 
 
 def load_registry():
-    if os.path.exists(APPS_JSON):
-        with open(APPS_JSON, "r", encoding="utf-8") as f:
-            return json.load(f)
-    return {}
+    """Copy of the whole registry from the in-memory store."""
+    return registry_store.snapshot()
 
 
 def save_registry(registry):
-    with open(APPS_JSON, "w", encoding="utf-8") as f:
-        json.dump(registry, f, indent=2)
+    """Store a whole registry dict, only changed entries hit the journal."""
+    registry_store.replace_all(registry)
 
 
 def calc_crc(data):
-    calculator_IEEE = Calculator(config_IEEE)
+    return zlib.crc32(data)
 
-    crc = calculator_IEEE.checksum(data)
-    return crc
+
+def write_icon_bin(data, bin_path):
+    """Write .bin contents and return the manifest fields stored in the registry."""
+    with open(bin_path, "wb") as f:
+        f.write(data)
+    return {
+        "icon_crc": calc_crc(data),
+        "icon_size": len(data),
+        "icon_mtime": os.path.getmtime(bin_path),
+    }
 
 # -----------------------------
 # Functions
@@ -117,113 +141,123 @@ def extract_icon_from_exe(exe_path, output_png_folder=ICON_PNG_FOLDER):
         img.save(output_png, "PNG")
         os.remove(TEMP_ICON)
 
-        print(f"Saved PNG icon: {output_png}")
+        log.debug("Saved PNG icon: %s", output_png)
         return img, output_png
     except Exception as e:
-        print(f"Failed to extract icon from {exe_path}: {e}")
+        log.warning("Failed to extract icon from %s: %s", exe_path, e)
         return None, None
 
 
 def convert_png_to_lvgl_bin(img: Image.Image, app_name, output_folder=LVGL_BIN_FOLDER, size=ICON_SIZE):
     """
     Convert PIL.Image -> LVGL RGB565 .bin
+    Returns (bin_path, manifest fields), see write_icon_bin.
     """
-    img = img.convert("RGB").resize(size, Image.Resampling.LANCZOS)
-    width, height = img.size
-    pixels = list(img.getdata())
-
-    header = b"LVGL" + struct.pack("<HHB", width, height, LV_IMG_CF_TRUE_COLOR)
-
-    pixel_data = bytearray()
-    for r, g, b in pixels:
-        rgb565 = ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
-        pixel_data += struct.pack("<H", rgb565)
-
     bin_path = os.path.join(output_folder, f"{app_name}.bin")
-    with open(bin_path, "wb") as f:
-        f.write(header)
-        f.write(pixel_data)
+    info = write_icon_bin(encode_lvgl_bin(img, size), bin_path)
 
-    print(f"Saved LVGL .bin icon: {bin_path}")
-    return bin_path
+    log.debug("Saved LVGL .bin icon: %s", bin_path)
+    return bin_path, info
 
 
-def calculate_scores(apps, alpha=1.0, beta=2.0):
-    """Update registry with scores and return scored list."""
-    now = datetime.now()
-    scored_apps = []
+def convert_pngs_to_lvgl_bin(items, output_folder=LVGL_BIN_FOLDER, size=ICON_SIZE):
+    """
+    Batch convert [(PIL.Image, app_name), ...] -> LVGL RGB565 .bin files.
+    Returns [(bin_path, manifest fields), ...] in the same order.
+    """
+    items = list(items)
+    results = []
+    for (_, app_name), data in zip(items, encode_lvgl_bins([img for img, _ in items], size)):
+        bin_path = os.path.join(output_folder, f"{app_name}.bin")
+        results.append((bin_path, write_icon_bin(data, bin_path)))
 
-    for app_name, data in apps.items():
-        times_run = data.get("times_run", 0)
-        last_run_str = data.get("last_run", None)
+    log.debug("Saved %d LVGL .bin icons to %s", len(results), output_folder)
+    return results
 
-        # Default
-        recency_score = 0
-        if last_run_str:
-            try:
-                last_run = datetime.fromisoformat(last_run_str)
-                days_since = (now - last_run).days
-                if days_since < 1:
-                    recency_score = 10
-                elif days_since < 3:
-                    recency_score = 5
-                elif days_since < 7:
-                    recency_score = 2
-            except Exception:
-                recency_score = 0
 
-        score = (times_run * alpha) + (recency_score * beta)
+def get_app_icon(exe_path, app_name):
+    """
+    Return (png_path, bin_path, manifest fields) for an exe, from the icon
+    cache when the exe did not change since it was converted,
+    (None, None, None) on failure.
+    """
+    cached = icon_cache.lookup(exe_path)
+    if cached and cached.get("info"):
+        ICON_CACHE_HITS.inc()
+        return cached["png"], cached["bin"], cached["info"]
 
-        # 🔥 Store score in registry
-        data["score"] = score
-        apps[app_name] = data
+    with ICON_STAGE_SECONDS.labels("extract").time():
+        pil_icon, png_path = extract_icon_from_exe(exe_path)
+    if not pil_icon:
+        return None, None, None
+    with ICON_STAGE_SECONDS.labels("convert").time():
+        bin_path, info = convert_png_to_lvgl_bin(pil_icon, app_name)
+    icon_cache.store(exe_path, png_path, bin_path, info)
+    return png_path, bin_path, info
 
-        scored_apps.append((app_name, score))
 
-    scored_apps.sort(key=lambda x: x[1], reverse=True)
-    return scored_apps
+def pick_top_apps(limit=TOP_K):
+    """Top apps by decayed launch count, best first."""
+    return app_ranking.top(limit)
 
 
-def pick_top_apps(apps, limit=12):
-    """Pick top apps based on score."""
-    scored_apps = calculate_scores(apps)
-    return [name for name, score in scored_apps[:limit]]
+def write_top_apps(top12, path=TOP_APPS_JSON):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"top12": top12}, f, indent=2)
+    os.replace(tmp_path, path)
 
 
 def find_app_icon_task():
     new_app_detected.set()
-    seen_pids = set()
+    watcher = ProcessWatcher()
+    # processes that are not (yet) user apps, re-checked until they get a
+    # visible window or exit: every tick for PENDING_TIMEOUT, then every
+    # PENDING_RECHECK seconds: (pid, create_time) -> [first seen, next check]
+    pending = {}
     current_user = getpass.getuser()
-    registry = load_registry()
 
     while True:
-        window_pid_map = enum_windows_pid_map()
-        for proc in psutil.process_iter(['pid', 'name', 'exe', 'username']):
-            pid = proc.info['pid']
-            if pid in seen_pids:
+        started, exited = watcher.poll()
+        now = time.monotonic()
+        for key in exited:
+            pending.pop(key, None)
+        for key in started:
+            pending[key] = [now, now]
+
+        due = [key for key, (_, next_check) in pending.items() if next_check <= now]
+        window_pid_map = enum_windows_pid_map() if due else {}
+        for key in due:
+            first_seen = pending[key][0]
+            pending[key][1] = now if now - first_seen < PENDING_TIMEOUT else now + PENDING_RECHECK
+            pid = key[0]
+            try:
+                proc = psutil.Process(pid)
+            except psutil.NoSuchProcess:
+                del pending[key]
                 continue
             if is_user_app(proc, window_pid_map, current_user=current_user):
+                del pending[key]
                 try:
-                    raw_name = proc.info['name']
-                    exe = proc.info['exe']
+                    raw_name = proc.name()
+                    exe = proc.exe()
                     base_name = os.path.splitext(raw_name)[0]
                     safe_name = "".join(
                         c for c in base_name if c.isalnum() or c in (" ", "_")).rstrip()
 
-                    print("New user app:", pid, raw_name, exe)
-
-                    pil_icon, png_path = extract_icon_from_exe(exe)
-                    if pil_icon:
-                        bin_path = convert_png_to_lvgl_bin(pil_icon, safe_name)
+                    log.info("New user app: %d %s %s", pid, raw_name, exe)
 
+                    png_path, bin_path, icon_info = get_app_icon(exe, safe_name)
+                    if bin_path:
                         # Save PID-specific copy for debugging
-                        pid_png_path = os.path.join(
-                            OUTPUT_FOLDER, f"{safe_name}_{pid}.png")
-                        pil_icon.save(pid_png_path)
-                        print(f"Saved icon: {pid_png_path}")
-
-                        # Update registry
-                        app_entry = registry.get(safe_name, {
+                        if SAVE_PID_COPIES:
+                            pid_png_path = os.path.join(
+                                OUTPUT_FOLDER, f"{safe_name}_{pid}.png")
+                            icon_cache.save_pid_copy(png_path, pid_png_path)
+                            log.debug("Saved icon: %s", pid_png_path)
+
+                        # Update registry, one journal record per launch
+                        app_entry = registry_store.get(safe_name, {
                             "exe_path": exe,
                             "friendly_name": safe_name,
                             "icon_bin": bin_path,
@@ -231,52 +265,62 @@ def find_app_icon_task():
                             "times_run": 0,
                             "last_run": None
                         })
+                        app_entry.update(icon_info)
                         app_entry["times_run"] += 1
                         app_entry["last_run"] = datetime.now().isoformat()
 
-                        registry[safe_name] = app_entry
+                        app_entry["rank_key"] = app_ranking.record_launch(safe_name)
+                        registry_store.put(safe_name, app_entry)
+                except Exception as e:
+                    log.error("Error handling proc: %s", e)
+        watcher.wait(CHECK_INTERVAL)
 
-                        # Recalculate scores & save
-                        scored = calculate_scores(registry)
-                        save_registry(registry)
 
-                        # Pick top 12
-                        top12 = [name for name, score in scored[:12]]
-                        with open("top_apps.json", "w", encoding="utf-8") as f:
-                            json.dump({"top12": top12}, f, indent=2)
+def icon_offer(entry):
+    """Offer message for a registry entry, from the stored manifest fields."""
+    return {
+        "new_app": entry["friendly_name"],
+        "height": HEIGHT,
+        "width": WIDTH,
+        "size": entry["icon_size"],
+        "crc": entry["icon_crc"],
+        "score": round(app_ranking.score(entry["friendly_name"]), 3)
+    }
 
-                        save_registry(registry)
 
-                        seen_pids.add(pid)
-                except Exception as e:
-                    print("Error handling proc:", e)
-        time.sleep(CHECK_INTERVAL)
-
-
-def create_icon_message():
-    apps_list = load_registry()
-
-    for key in apps_list:
-        entry = apps_list[key]
-        icon_path = entry["icon_bin"]
-        with open(icon_path, 'rb') as icon_file:
-            icon_data = icon_file.read()
-
-        app_name = entry["friendly_name"]
-        score = entry.get("score", 0)
-        crc = calc_crc(icon_data)
-        size = len(icon_data)
-
-        message = {
-            "new_app": app_name,
-            "height": HEIGHT,
-            "width": WIDTH,
-            "size": size,
-            "crc": crc,
-            "score": score
-        }
-
-        yield message, icon_data
+def create_icon_message(names=None):
+    """
+    Build the icon manifest for the given registry keys, all apps by default.
+    Returns [(offer message, bin_path), ...]; icon files are only read when
+    an icon is sent (load_icon_data). Entries from before the CRC was stored
+    are hashed once and written back to the store.
+    """
+    manifest = []
+
+    for key in (names if names is not None else registry_store.keys()):
+        entry = registry_store.get(key)
+        if entry is None:
+            continue
+        if "icon_crc" not in entry or "icon_size" not in entry:
+            try:
+                with open(entry["icon_bin"], 'rb') as icon_file:
+                    icon_data = icon_file.read()
+            except OSError as e:
+                log.warning("Missing icon for %s: %s", key, e)
+                continue
+            entry["icon_crc"] = calc_crc(icon_data)
+            entry["icon_size"] = len(icon_data)
+            entry["icon_mtime"] = os.path.getmtime(entry["icon_bin"])
+            registry_store.put(key, entry)
+
+        manifest.append((icon_offer(entry), entry["icon_bin"]))
+
+    return manifest
+
+
+def load_icon_data(bin_path):
+    with open(bin_path, 'rb') as icon_file:
+        return icon_file.read()
 
 
 # def abc():
@@ -0,0 +1,54 @@
+import struct
+from PIL import Image, ImageChops
+
+LV_IMG_CF_TRUE_COLOR = 0x02  # RGB565
+ICON_SIZE = (100, 100)
+
+# RGB565 little endian, per pixel:
+#   low byte  = GGGBBBBB  (g bits 2..4, b bits 3..7)
+#   high byte = RRRRRGGG  (r bits 3..7, g bits 5..7)
+# every part is a function of one channel, so the bytes are built with
+# per-band lookup tables in Pillow instead of a Python loop per pixel.
+# the parts never share bits, so adding them is the same as or-ing them.
+_R_HIGH = [v & 0xF8 for v in range(256)]
+_G_HIGH = [v >> 5 for v in range(256)]
+_G_LOW = [(v << 3) & 0xE0 for v in range(256)]
+_B_LOW = [v >> 3 for v in range(256)]
+
+
+def lvgl_header(width, height):
+    return b"LVGL" + struct.pack("<HHB", width, height, LV_IMG_CF_TRUE_COLOR)
+
+
+def rgb565_bytes(img: Image.Image):
+    """Pixels of an RGB image as little endian RGB565."""
+    r, g, b = img.split()
+    high = ImageChops.add(r.point(_R_HIGH), g.point(_G_HIGH))
+    low = ImageChops.add(g.point(_G_LOW), b.point(_B_LOW))
+    return Image.merge("LA", (low, high)).tobytes()
+
+
+def encode_lvgl_bin(img: Image.Image, size=ICON_SIZE):
+    """PIL.Image -> LVGL RGB565 .bin contents (header + pixels)."""
+    img = img.convert("RGB").resize(size, Image.Resampling.LANCZOS)
+    width, height = img.size
+    return lvgl_header(width, height) + rgb565_bytes(img)
+
+
+def encode_lvgl_bins(images, size=ICON_SIZE):
+    """
+    Batch version of encode_lvgl_bin. The resized images are stacked into one
+    strip so the colour conversion runs once for the whole batch.
+    """
+    resized = [img.convert("RGB").resize(size, Image.Resampling.LANCZOS) for img in images]
+    if not resized:
+        return []
+    width, height = size
+    strip = Image.new("RGB", (width, height * len(resized)))
+    for i, img in enumerate(resized):
+        strip.paste(img, (0, i * height))
+
+    pixels = rgb565_bytes(strip)
+    header = lvgl_header(width, height)
+    step = width * height * 2
+    return [header + pixels[i * step:(i + 1) * step] for i in range(len(resized))]
@@ -1,19 +1,55 @@
+import os
+import logging
 import time
-import json
+import asyncio
 import threading
 import pythoncom
-import screen_brightness_control as sbc
 
 # locale imports
-from audio import set_volume
-from actions import do_action
-from serial_device import serial_handshake, find_serial_port, build_slow_message, build_fast_messege
-from icons import find_app_icon_task, create_icon_message
-from globals import board_is_connected, new_app_detected
+from audio import set_volume, add_volume_listener
+from brightness import set_brightness
+from actions import do_action, load_actions, dispatcher as action_dispatcher
+from serial_device import serial_handshake, open_serial_port, build_slow_message, build_fast_messege, telemetry
+from icons import find_app_icon_task, create_icon_message, load_icon_data, load_registry, pick_top_apps, app_ranking
+from icon_sync import plan_icon_sync, parse_inventory, ICON_SLOTS
+from protocol import get_codec, PROTOCOL_BINARY
+from icon_transfer import IconTransfer, encode_payload, XFER_WINDOWED, ENC_RLE, CHUNK_SIZE
+from delta import DeltaEncoder, KEYFRAME_INTERVAL
+from cadence import AdaptiveCadence
+from power import PowerPolicy, POWER_CHECK_INTERVAL
+from serial_writer import PRIORITY_INTERACTIVE, PRIORITY_FAST, PRIORITY_SLOW, PRIORITY_BULK
+from engine import SerialEngine
+from capture import CaptureWriter, CapturePort
+from supervisor import Supervisor
+from hotplug import DeviceWatcher
+from actuators import CoalescingActuator, BRIGHTNESS_MIN_INTERVAL, VOLUME_MIN_INTERVAL
+from globals import board_is_connected, new_app_detected, icon_requested, inventory_received
+import metrics
+
+log = logging.getLogger(__name__)
+
+ICON_STAGE_SECONDS = metrics.histogram("icon_stage_seconds", "Time per icon pipeline stage", ("stage",))
 
 
 SERIAL_TIMEOUT = 5000
 MAX_JSON_ERRORS = 15
+ICON_REQUEST_TIMEOUT = 1  # seconds to wait for the board to ask for an offered icon
+INVENTORY_TIMEOUT = 1  # seconds to wait for the board's icon inventory
+SLOW_INTERVAL = 0.5  # seconds between slow telemetry messages
+FAST_INTERVAL = 0.02  # seconds between fast telemetry messages
+
+LOG_LEVEL = logging.INFO  # logging.DEBUG for per-message detail
+
+# local metrics in the Prometheus text format: served on
+# http://127.0.0.1:METRICS_PORT/metrics and / or written to METRICS_FILE
+# every METRICS_FILE_INTERVAL seconds; None turns either off
+METRICS_PORT = 9464
+METRICS_FILE = None
+METRICS_FILE_INTERVAL = 10
+
+# record every byte of each session to CAPTURE_DIR/session-<time>.cap for
+# offline replay with capture.py; None turns capturing off
+CAPTURE_DIR = None
 
 # Choose the correct vid and pid of your board.
 # On windows: Device Manager > device > Properties > Details > Hardware ID.
@@ -28,149 +64,366 @@ MAX_JSON_ERRORS = 15
 serial_chip_vid = 6790
 serial_chip_pid = 29987
 
-serial_lock = threading.Lock()
-
-
-def icon_write_task(port):
-    pythoncom.CoInitialize()
-    # while board_is_connected.is_set():
-    new_app_detected.clear()
-    for message, icon_data in create_icon_message():
-        with serial_lock:
-            print(message)
-            port.read_all()  # flush input
-            port.write((json.dumps(message) + "\n").encode("utf-8"))
-            port.flush()
-            time.sleep(0.2)
-
-            # wait for ESP32 to request the icon
-            if port.in_waiting > 0:
-                data = port.read_until(b"\n").decode("utf-8").strip()
-                if data:
-                    try:
-                        data_json = json.loads(data)
-                        if "waiting_for_icon" in data_json:
-                            port.read_all()  # flush input
-                            # send icon in chunks
-                            CHUNK_SIZE = 512
-                            for i in range(0, len(icon_data), CHUNK_SIZE):
-                                chunk = icon_data[i:i+CHUNK_SIZE]
-                                port.write(chunk)
-                                port.flush()
-                                time.sleep(0.01)
-
-                            # signal done
-                            done_msg = {"done": "done"}
-                            port.write(
-                                (json.dumps(done_msg) + "\n").encode("utf-8"))
-                            port.flush()
-                    except json.JSONDecodeError:
-                        print("Invalid JSON:", data)
-
-
-def slow_write_task(port):
-    pythoncom.CoInitialize()
-    while board_is_connected.is_set():
-
-        messege = build_slow_message()
-        # print(messege)
-        with serial_lock:
-            port.read_all()
-            port.write((messege + "\n").encode("utf-8"))
-            port.flush()
-            time.sleep(0.5)
-
-
-def fast_write_task(port):
-    pythoncom.CoInitialize()
-    while board_is_connected.is_set():
-        messege = build_fast_messege()
-        with serial_lock:
-            port.read_all()
-            port.write((messege + "\n").encode("utf-8"))
-            port.flush()
-            # time.sleep(0.02)
+# seconds one wait for the board lasts before logging and waiting again, and
+# before retrying a port that was found but could not be opened
+DEVICE_WAIT = 30
+OPEN_RETRY = 0.5
 
+# offer the framed binary protocol during the handshake,
+# boards that do not answer with it keep using JSON
+USE_BINARY_PROTOCOL = False
 
-def read_task(port):
-    pythoncom.CoInitialize()
+# only send telemetry keys that changed, with a full keyframe every
+# KEYFRAME_INTERVAL seconds, on reconnect and when the board asks for one
+DELTA_TELEMETRY = False
 
-    while board_is_connected.is_set():
-        if port.in_waiting > 0:
-            data = port.read_until(b"\n").decode('utf-8').strip()
-            if data:  # only process if not empty
-                try:
-                    data = json.loads(data)  # decode JSON
+# pick the fast telemetry interval per message: FAST_INTERVAL while values
+# change, backing off to FAST_IDLE_INTERVAL when steady or the link is congested
+ADAPTIVE_CADENCE = True
+FAST_IDLE_INTERVAL = 0.25
 
-                    # print(data)
+# switch send / sampling intervals with the power source and pause the fast
+# telemetry while the user is idle or the session is locked (see power.py);
+# POWER_PROFILE forces one of PROFILES instead of following the power source
+POWER_POLICY = True
+POWER_PROFILE = None
 
-                    # --- handle parsed data ---
-                    if isinstance(data, dict):  # only process dict JSON objects
-                        if "command" in data:
-                            var_command = data.get("command")
-                            if var_command:
-                                do_action(var_command)
+# sync icons with the board after the handshake (boards that report an inventory)
+ICON_SYNC = True
 
-                        else:
-                            var_set_volume = data.get("setVolume")
-                            var_set_brightness = data.get("setBrightness")
+# icon payload encoding for the windowed transfer (ENC_RLE or ENC_RAW)
+ICON_ENCODING = ENC_RLE
 
-                            if var_set_brightness is not None:
-                                sbc.set_brightness(var_set_brightness)
-                            if var_set_volume is not None:
-                                set_volume(var_set_volume)
-                    else:
-                        print("Received non-dict JSON:", data)
+slow_delta = DeltaEncoder(KEYFRAME_INTERVAL)
+fast_delta = DeltaEncoder(KEYFRAME_INTERVAL)
+fast_cadence = AdaptiveCadence(FAST_INTERVAL, FAST_IDLE_INTERVAL)
 
-                except json.JSONDecodeError:
-                    print("Invalid JSON:", data)
+active_engine = None
+active_transfer = None
+board_inventory = None
+icon_sync_lock = threading.Lock()  # one icon sync at a time
+power_policy = None
 
+# slider drags send many setpoints, only the newest one is applied
+brightness_actuator = CoalescingActuator(
+    "brightness", set_brightness, BRIGHTNESS_MIN_INTERVAL, thread_init=pythoncom.CoInitialize)
+volume_actuator = CoalescingActuator(
+    "volume", set_volume, VOLUME_MIN_INTERVAL, thread_init=pythoncom.CoInitialize)
 
-def main():
-    port = None
-
-    while True:
-        # Try to find and connect to device
-        if port is None:
-            port = find_serial_port(serial_chip_vid, serial_chip_pid)
-            if port is None:
-                print("Device not found, retrying...")
-                time.sleep(0.7)
-                continue
 
-        # Perform handshake
-        if port is not None:
-            if serial_handshake(port):
-                board_is_connected.set()
-            else:
-                print("Handshake failed")
-                board_is_connected.clear()
-                port.close()
-                port = None
+def icon_write_task(engine, offers=None):
+    """Offer and send icons, offers is a manifest from create_icon_message, every app by default."""
+    global active_transfer
+    pythoncom.CoInitialize()
+    codec = engine.codec
+    # bin1 boards get the windowed, acknowledged transfer
+    windowed = codec.name == PROTOCOL_BINARY
+    # while board_is_connected.is_set():
+    new_app_detected.clear()
+    for message, bin_path in (offers if offers is not None else create_icon_message()):
+        try:
+            with ICON_STAGE_SECONDS.labels("load").time():
+                icon_data = load_icon_data(bin_path)
+        except OSError as e:
+            log.warning("Skipping icon %s: %s", message["new_app"], e)
+            continue
+        payload = icon_data
+        if windowed:
+            with ICON_STAGE_SECONDS.labels("encode").time():
+                enc, payload = encode_payload(icon_data, ICON_ENCODING)
+            message = dict(message, xfer=XFER_WINDOWED, enc=enc,
+                           zsize=len(payload), chunks=-(-len(payload) // CHUNK_SIZE))
+        log.debug("Offering icon %s", message)
+        icon_requested.clear()
+        # checked after the clear: a disconnect from here on sets the event
+        if not board_is_connected.is_set():
+            return
+        if not windowed:
+            # the board reads the raw icon by length right after it asks for
+            # it, keep telemetry off the link from the offer to the done message
+            engine.writer.hold(PRIORITY_BULK)
+        engine.push(message, PRIORITY_BULK)
+
+        # wait for ESP32 to request the icon, handle_message sets the event
+        with ICON_STAGE_SECONDS.labels("request").time():
+            requested = icon_requested.wait(ICON_REQUEST_TIMEOUT)
+        if not board_is_connected.is_set():
+            return
+        if not requested:
+            engine.writer.release()
+            continue
+
+        if windowed:
+            transfer = IconTransfer(payload, lambda seq, chunk: engine.writer.submit(
+                codec.encode_chunk(seq, chunk), PRIORITY_BULK, paced=False))
+            active_transfer = transfer
+            if not board_is_connected.is_set():
+                transfer.abort()  # the stop callback may have missed it
+            with ICON_STAGE_SECONDS.labels("transfer").time():
+                ok = transfer.run()
+            active_transfer = None
+            log.info("Icon %s transfer: %s", message["new_app"], transfer.stats())
+            if not ok:
                 continue
-
-        if port is not None:
-            t1 = threading.Thread(target=slow_write_task, args=(port,))
-            t2 = threading.Thread(target=fast_write_task, args=(port,))
-            t3 = threading.Thread(target=read_task, args=(port,))
-            # t4 = threading.Thread(target=find_app_icon_task)
-
-            if board_is_connected.is_set():
-                t1.start()
-                t2.start()
-                t3.start()
-                # t4.start()
-
-        while board_is_connected.is_set():
-           # if new_app_detected.is_set():
-            # icon_write_task(port)
-           # else:
-            time.sleep(1)
-
+            # signal done
+            engine.push({"done": "done"}, PRIORITY_BULK)
+        else:
+            # the board reads size raw bytes, so nothing may go out between
+            # the chunks and the done message
+            engine.writer.submit_bulk(icon_data, codec.encode_raw,
+                                      trailer=codec.encode({"done": "done"}), exclusive=True)
+
+
+def request_inventory(engine):
+    """Ask the board which icons it stores, None if it does not answer."""
+    global board_inventory
+    board_inventory = None
+    inventory_received.clear()
+    if not board_is_connected.is_set():
+        return None
+    engine.push({"inventory": "?"}, PRIORITY_INTERACTIVE)
+    if not inventory_received.wait(INVENTORY_TIMEOUT) or not board_is_connected.is_set():
+        return None
+    return board_inventory
+
+
+def _wake_icon_tasks():
+    """Session ended: end the icon waits now instead of after their timeouts."""
+    icon_requested.set()
+    inventory_received.set()
+    transfer = active_transfer
+    if transfer is not None:
+        transfer.abort()
+
+
+def icon_sync_task(engine):
+    """Send only the top icons the board is missing, then delete the ones that left the top set."""
+    with icon_sync_lock:
+        _icon_sync(engine)
+
+
+def _icon_sync(engine):
+    inventory = request_inventory(engine)
+    if inventory is None:
+        log.info("Board did not report an icon inventory, skipping icon sync")
+        return
+
+    top = pick_top_apps(ICON_SLOTS)
+    offers = {message["new_app"]: (message, bin_path)
+              for message, bin_path in create_icon_message(top)}
+    send, delete = plan_icon_sync(
+        inventory, {name: message["crc"] for name, (message, _) in offers.items()}, top)
+    log.info("Icon sync: %d to send, %d to delete", len(send), len(delete))
+
+    for name in delete:
+        engine.push({"delete_app": name}, PRIORITY_BULK)
+    icon_write_task(engine, [offers[name] for name in send])
+
+
+def handle_message(engine, data):
+    """Handle one message from the board, runs in an engine executor thread."""
+    global board_inventory
+    # print(data)
+
+    # any input from the board means someone is using it
+    if power_policy is not None:
+        power_policy.wake()
+        engine.wake()
+
+    # --- handle parsed data ---
+    if isinstance(data, dict):  # only process dict JSON objects
+        if "waiting_for_icon" in data:
+            icon_requested.set()
+
+        elif "inventory" in data:
+            board_inventory = parse_inventory(data["inventory"])
+            inventory_received.set()
+
+        elif "ack" in data:
+            transfer = active_transfer
+            if transfer is not None:
+                transfer.on_ack(data["ack"])
+
+        elif data.get("keyframe"):
+            # board lost track of the telemetry state
+            slow_delta.reset()
+            fast_delta.reset()
+
+        elif "command" in data:
+            var_command = data.get("command")
+            if var_command:
+                do_action(var_command, engine.received_at)
+
+        else:
+            var_set_volume = data.get("setVolume")
+            var_set_brightness = data.get("setBrightness")
+
+            if var_set_brightness is not None:
+                brightness_actuator.submit(var_set_brightness)
+            if var_set_volume is not None:
+                volume_actuator.submit(var_set_volume)
+    else:
+        log.warning("Received non-dict JSON: %r", data)
+
+
+def on_top_apps_changed(top):
+    """The ranked top apps changed, bring the board's icons up to date."""
+    engine = active_engine
+    if ICON_SYNC and engine is not None and board_is_connected.is_set():
+        engine.executor.submit(icon_sync_task, engine)
+
+
+def on_volume_changed(volume):
+    """Push volume changes made on the host as soon as Windows reports them."""
+    engine = active_engine
+    if engine is not None and board_is_connected.is_set():
+        engine.push({"volume": volume}, PRIORITY_FAST)
+
+
+def _written_bytes():
+    engine = active_engine
+    return engine.writer.bytes_written if engine is not None else 0
+
+
+def start_services():
+    """Everything that outlives a connection: actuators, sampler, listeners."""
+    global power_policy
+    brightness_actuator.start()
+    volume_actuator.start()
+    log.info("Loaded %d board commands", load_actions(load_registry()))
+    if POWER_POLICY:
+        power_policy = PowerPolicy(telemetry, fast_cadence, POWER_PROFILE,
+                                   bytes_source=_written_bytes)
+        telemetry.add("power", lambda: power_policy.update(telemetry.get("battery")),
+                      POWER_CHECK_INTERVAL)
+    telemetry.start()
+    pythoncom.CoInitialize()
+    app_ranking.add_listener(on_top_apps_changed)
+    if not add_volume_listener(on_volume_changed):
+        log.info("No volume change notifications, polling volume")
+
+
+def print_session_stats(engine):
+    log.info("writer stats: %s", engine.writer.stats())
+    log.info("decoder stats: %s", engine.decoder.stats())
+    log.info("brightness actuator: %s", brightness_actuator.stats())
+    log.info("volume actuator: %s", volume_actuator.stats())
+    log.info("telemetry cost: %s", telemetry.stats())
+    log.info("actions: %s", action_dispatcher.stats())
+    if ADAPTIVE_CADENCE:
+        log.info("fast cadence: %s", fast_cadence.stats())
+    if power_policy is not None:
+        log.info("power: %s", power_policy.report())
+    log.info("session: ended by %s, %d handler errors, build errors %s, supervisor %s, discovery %s",
+             engine.end_reason, engine.handler_errors, engine.build_errors, supervisor.stats(), device_watcher.stats())
+
+
+def run_session(port):
+    """
+    Handshake on an open port and stream until the board disconnects.
+    Returns the engine of the finished session, None when the handshake failed.
+    """
+    global active_engine
+    capture = None
+    if CAPTURE_DIR is not None:
+        os.makedirs(CAPTURE_DIR, exist_ok=True)
+        capture = CaptureWriter(os.path.join(
+            CAPTURE_DIR, time.strftime("session-%Y%m%d-%H%M%S.cap")))
+        port = CapturePort(port, capture)
+
+    protocol = serial_handshake(port, offer_binary=USE_BINARY_PROTOCOL)
+    if capture is not None:
+        capture.note(f"protocol {protocol}" if protocol else "handshake failed")
+    if not protocol:
+        if capture is not None:
+            capture.close()
+        log.warning("Handshake failed")
         board_is_connected.clear()
+        return None
+
+    codec = get_codec(protocol)
+    slow_delta.reset()
+    fast_delta.reset()
+    fast_cadence.reset()
+    board_is_connected.set()
+
+    engine = SerialEngine(port, codec, handle_message,
+                          thread_init=pythoncom.CoInitialize,
+                          max_errors=MAX_JSON_ERRORS)
+    engine.on_stop(_wake_icon_tasks)
+    if power_policy is not None:
+        slow_interval = lambda: power_policy.interval("slow")
+        fast_interval = lambda: power_policy.interval("fast")
+        fast_paused = power_policy.paused
+    else:
+        slow_interval, fast_interval, fast_paused = SLOW_INTERVAL, FAST_INTERVAL, None
+    engine.every(slow_interval, build_slow_message, PRIORITY_SLOW,
+                 slow_delta if DELTA_TELEMETRY else None)
+    engine.every(fast_interval, build_fast_messege, PRIORITY_FAST,
+                 fast_delta if DELTA_TELEMETRY else None,
+                 fast_cadence if ADAPTIVE_CADENCE else None,
+                 fast_paused)
+    if ICON_SYNC:
+        engine.after_start(icon_sync_task)
+    # threading.Thread(target=find_app_icon_task).start()
+    # if new_app_detected.is_set():
+    #     threading.Thread(target=icon_write_task, args=(engine,)).start()
+
+    # runs until the board disconnects
+    active_engine = engine
+    try:
+        asyncio.run(engine.run())
+    except Exception as e:
+        log.error("Connection error: %s", e)
+    active_engine = None
+    board_is_connected.clear()
+    if capture is not None:
+        capture.close()
+    print_session_stats(engine)
+    return engine
+
+
+def _session_gauges():
+    gauges = {"board_connected": board_is_connected.is_set()}
+    engine = active_engine
+    if engine is not None:
+        for name, depth in engine.writer.stats()["queue_depth"].items():
+            gauges[f"writer_queue_depth_{name}"] = depth
+    if ADAPTIVE_CADENCE:
+        gauges["fast_interval_seconds"] = fast_cadence.interval
+    if power_policy is not None:
+        gauges["fast_paused"] = power_policy.paused()
+    return gauges
+
+
+def _open_port():
+    """Wait for the board to be plugged in and open its port."""
+    found = device_watcher.wait(DEVICE_WAIT)
+    if found is None:
+        log.debug("Device not found, still waiting...")
+        return None
+    port = open_serial_port(found.device)
+    if port is None:
+        # e.g. udev has not granted access yet, retry on its next change
+        device_watcher.wait_change(OPEN_RETRY)
+    return port
+
+
+device_watcher = DeviceWatcher(serial_chip_vid, serial_chip_pid)
+supervisor = Supervisor(_open_port, run_session, appeared_at=lambda: device_watcher.appeared_at)
+
 
-        port.close()
-        port = None
+def main():
+    logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    metrics.add_collector(_session_gauges)
+    if METRICS_PORT is not None:
+        metrics.serve(METRICS_PORT)
+    if METRICS_FILE is not None:
+        metrics.write_file(METRICS_FILE, METRICS_FILE_INTERVAL)
+    start_services()
+
+    # connect, stream until the board goes away, reconnect with backoff
+    supervisor.run()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,213 @@
+import os
+import time
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+log = logging.getLogger(__name__)
+
+# -----------------------------
+# Counters and latency histograms
+# -----------------------------
+# Module level registry, hot paths keep a reference to their metric and call
+# inc() / observe() (a lock and a bisect). render() returns the Prometheus
+# text format, served by serve() on localhost or written by write_file().
+#   counter("serial_bytes_written_total", "...").inc(n)
+#   with histogram("build_seconds", "...", ("sender",)).labels("fast").time(): ...
+# Collectors add gauges from the existing stats() dicts at render time.
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_lock = threading.Lock()
+_metrics = {}
+_collectors = []
+
+
+def _label_text(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{value}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Timer:
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=(), labelvalues=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.labelvalues = labelvalues
+        self._children = {}
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(
+                    values, type(self)(self.name, self.help, self.labelnames, values))
+        return child
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def _series(self):
+        return self._children.values() if self.labelnames else (self,)
+
+    def render(self):
+        lines = []
+        for child in self._series():
+            lines.append(f"{self.name}{_label_text(self.labelnames, child.labelvalues)} {child.value}")
+        return lines
+
+
+class Histogram(Counter):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), labelvalues=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames, labelvalues)
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(
+                    values, Histogram(self.name, self.help, self.labelnames, values, self.buckets))
+        return child
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    def time(self):
+        """Context manager that observes the time spent inside it."""
+        return _Timer(self)
+
+    def render(self):
+        lines = []
+        for child in self._series():
+            names = self.labelnames + ("le",)
+            total = 0
+            for bound, count in zip(child.buckets + ("+Inf",), child.counts):
+                total += count
+                labels = _label_text(names, child.labelvalues + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {total}")
+            labels = _label_text(self.labelnames, child.labelvalues)
+            lines.append(f"{self.name}_sum{labels} {child.sum}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+def _get(cls, name, help_text, labelnames, **kwargs):
+    with _lock:
+        metric = _metrics.get(name)
+        if metric is None:
+            metric = _metrics[name] = cls(name, help_text, tuple(labelnames), **kwargs)
+        return metric
+
+
+def counter(name, help_text, labelnames=()):
+    return _get(Counter, name, help_text, labelnames)
+
+
+def histogram(name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+    return _get(Histogram, name, help_text, labelnames, buckets=buckets)
+
+
+def add_collector(collect):
+    """collect() returns {metric name: number} gauges, read at render time."""
+    _collectors.append(collect)
+
+
+def render():
+    lines = []
+    with _lock:
+        metrics = list(_metrics.values())
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.render())
+    for collect in list(_collectors):
+        try:
+            gauges = collect()
+        except Exception as e:
+            log.warning("Metrics collector failed: %s", e)
+            continue
+        for name, value in gauges.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if isinstance(value, (int, float)):
+                lines.append(f"# TYPE {name} gauge")
+                lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# ------------ Export ------------
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        log.debug("metrics: " + format, *args)
+
+
+def serve(port, host="127.0.0.1"):
+    """Serve /metrics on localhost from a daemon thread, returns the server or None."""
+    try:
+        server = ThreadingHTTPServer((host, port), _Handler)
+    except OSError as e:
+        # a metrics endpoint is never worth not starting the daemon
+        log.warning("Metrics endpoint on %s:%d not started: %s", host, port, e)
+        return None
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    log.info("Metrics on http://%s:%d/metrics", host, port)
+    return server
+
+
+def write_file(path, interval):
+    """Rewrite path with the current metrics every interval seconds (daemon thread)."""
+    def run():
+        while True:
+            time.sleep(interval)
+            tmp_path = path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(render())
+            os.replace(tmp_path, path)
+
+    thread = threading.Thread(target=run, name="metrics-file", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,193 @@
+import logging
+import time
+import platform
+import threading
+
+log = logging.getLogger(__name__)
+
+system_type = platform.system()
+
+if system_type == "Windows":
+    import win32api
+    import win32con
+    import win32service
+
+# -----------------------------
+# Power policy
+# -----------------------------
+# Picks a profile from the power source (or POWER_PROFILE when set):
+#   performance / balanced  on AC power
+#   battery                 on battery, longer send and sampling intervals
+# and pauses the fast telemetry while the user has been idle for IDLE_PAUSE
+# seconds or the session is locked (screen off / lock screen). Any message
+# from the board wakes the fast loop right away.
+# report() shows time, CPU time and bytes written per state, and the
+# estimated savings against the performance profile (balanced when the
+# performance profile never ran).
+
+PROFILE_PERFORMANCE = "performance"
+PROFILE_BALANCED = "balanced"
+PROFILE_BATTERY = "battery"
+STATE_PAUSED = "paused"
+
+PROFILES = {
+    # fast_interval / fast_idle_interval bound the adaptive cadence,
+    # sample_scale stretches every telemetry sampling interval
+    PROFILE_PERFORMANCE: {"fast_interval": 0.02, "fast_idle_interval": 0.1,
+                          "slow_interval": 0.5, "sample_scale": 1},
+    PROFILE_BALANCED: {"fast_interval": 0.02, "fast_idle_interval": 0.25,
+                       "slow_interval": 0.5, "sample_scale": 1},
+    PROFILE_BATTERY: {"fast_interval": 0.05, "fast_idle_interval": 1.0,
+                      "slow_interval": 1.0, "sample_scale": 4},
+}
+
+AC_PROFILE = PROFILE_BALANCED
+IDLE_PAUSE = 5 * 60  # seconds without keyboard / mouse input before the fast loop pauses
+POWER_CHECK_INTERVAL = 2.0  # seconds between update() calls (scaled with the profile)
+
+
+def idle_seconds():
+    """Seconds since the last keyboard / mouse input, 0 when unknown."""
+    if system_type != "Windows":
+        return 0.0
+    return (win32api.GetTickCount() - win32api.GetLastInputInfo()) / 1000.0
+
+
+def session_locked():
+    """True while the lock screen is up (the input desktop can't be opened)."""
+    if system_type != "Windows":
+        return False
+    try:
+        desktop = win32service.OpenInputDesktop(0, False, win32con.DESKTOP_SWITCHDESKTOP)
+    except Exception:
+        return True
+    try:
+        desktop.SwitchDesktop()  # fails while the secure desktop is active
+        return False
+    except Exception:
+        return True
+    finally:
+        desktop.CloseDesktop()
+
+
+class PowerPolicy:
+    """
+    update() is called periodically with the battery state, it chooses the
+    profile and the pause state and applies the profile to the fast cadence
+    and the telemetry sampler. The engine reads interval() and paused().
+    """
+
+    def __init__(self, telemetry=None, cadence=None, profile=None, idle_pause=IDLE_PAUSE,
+                 bytes_source=None):
+        self.telemetry = telemetry
+        self.cadence = cadence
+        self.forced_profile = profile
+        self.idle_pause = idle_pause
+        self.bytes_source = bytes_source or (lambda: 0)
+
+        self._lock = threading.Lock()
+        self.profile = profile or AC_PROFILE
+        self._paused = False
+        self._woken_at = 0.0
+        self._apply(self.profile)
+
+        self._state = self.profile
+        self._since = time.monotonic()
+        self._cpu_at = time.process_time()
+        self._bytes_at = 0
+        self.usage = {}  # state -> [seconds, cpu seconds, bytes]
+        self.switches = 0
+
+    # ------------ Decisions ------------
+
+    def _apply(self, profile):
+        settings = PROFILES[profile]
+        if self.cadence is not None:
+            self.cadence.min_interval = settings["fast_interval"]
+            self.cadence.idle_interval = settings["fast_idle_interval"]
+        if self.telemetry is not None:
+            self.telemetry.set_scale(settings["sample_scale"])
+
+    def choose_profile(self, battery):
+        if self.forced_profile:
+            return self.forced_profile
+        if battery is not None and not battery[1]:
+            return PROFILE_BATTERY
+        return AC_PROFILE
+
+    def update(self, battery=None, idle=None, locked=None):
+        """battery is (percent, plugged in) or None; idle / locked are read when not given."""
+        idle = idle_seconds() if idle is None else idle
+        locked = session_locked() if locked is None else locked
+        profile = self.choose_profile(battery)
+        with self._lock:
+            # input from the board counts as activity, it keeps the loop awake
+            recently_woken = time.monotonic() - self._woken_at < self.idle_pause
+            paused = (locked or idle >= self.idle_pause) and not recently_woken
+            if profile != self.profile:
+                log.info("Power profile: %s -> %s", self.profile, profile)
+                self.profile = profile
+                self.switches += 1
+                self._apply(profile)
+            if paused != self._paused:
+                log.info("Fast telemetry %s", "paused" if paused else "resumed")
+                self._paused = paused
+            self._account(STATE_PAUSED if paused else profile)
+        return profile
+
+    def wake(self):
+        """Device input: resume the fast loop now."""
+        with self._lock:
+            self._woken_at = time.monotonic()
+            if self._paused:
+                log.info("Fast telemetry resumed (device input)")
+                self._paused = False
+                self._account(self.profile)
+
+    def paused(self):
+        return self._paused
+
+    def interval(self, kind):
+        """Current "fast" / "slow" send interval of the profile."""
+        return PROFILES[self.profile][kind + "_interval"]
+
+    # ------------ Accounting ------------
+
+    def _account(self, state):
+        now = time.monotonic()
+        cpu = time.process_time()
+        written = self.bytes_source()
+        if written < self._bytes_at:
+            self._bytes_at = 0  # new connection, the writer counts from zero
+        usage = self.usage.setdefault(self._state, [0.0, 0.0, 0])
+        usage[0] += now - self._since
+        usage[1] += cpu - self._cpu_at
+        usage[2] += written - self._bytes_at
+        self._state, self._since, self._cpu_at, self._bytes_at = state, now, cpu, written
+
+    def report(self):
+        with self._lock:
+            self._account(self._state)
+            usage = {state: list(values) for state, values in self.usage.items()}
+        states = {}
+        base_state = PROFILE_PERFORMANCE if PROFILE_PERFORMANCE in usage else PROFILE_BALANCED
+        base = usage.get(base_state)
+        for state, (seconds, cpu, written) in usage.items():
+            entry = {
+                "seconds": round(seconds, 1),
+                "cpu_s": round(cpu, 3),
+                "bytes": written,
+                "cpu_pct": round(cpu / seconds * 100, 2) if seconds else 0.0,
+                "bytes_per_s": round(written / seconds, 1) if seconds else 0.0,
+            }
+            # savings against running the same time in the base profile
+            if base and base[0] and state != base_state:
+                entry["cpu_saved_s"] = round(base[1] / base[0] * seconds - cpu, 3)
+                entry["bytes_saved"] = int(base[2] / base[0] * seconds - written)
+            states[state] = entry
+        return {
+            "profile": self.profile,
+            "paused": self._paused,
+            "switches": self.switches,
+            "states": states,
+        }
@@ -0,0 +1,180 @@
+import logging
+import os
+import time
+import select
+import socket
+import struct
+import platform
+
+import psutil
+
+log = logging.getLogger(__name__)
+
+# -----------------------------
+# Incremental process watcher
+# -----------------------------
+# poll() returns only the processes that started / exited since the last
+# call, as (pid, create_time) pairs so a reused PID is a new process.
+# Sources, best first:
+#   Linux netlink proc connector  exec / exit events (needs CAP_NET_ADMIN)
+#   Linux /proc scan              one scandir, (pid, inode) changes on PID reuse
+#   anything else                 psutil.pids() diff (a PID reused between two
+#                                 polls is not noticed)
+
+PROC_ROOT = "/proc"
+
+# linux/connector.h, linux/cn_proc.h
+NETLINK_CONNECTOR = 11
+CN_IDX_PROC = 1
+CN_VAL_PROC = 1
+PROC_CN_MCAST_LISTEN = 1
+PROC_EVENT_EXEC = 0x00000002
+PROC_EVENT_EXIT = 0x80000000
+
+NLMSGHDR = struct.Struct("=IHHII")
+CN_MSG = struct.Struct("=IIIIHH")
+PROC_EVENT = struct.Struct("=IIQ")
+EVENT_PIDS = struct.Struct("=II")  # pid, tgid of exec / exit events
+
+
+def _create_time(pid):
+    try:
+        return psutil.Process(pid).create_time()
+    except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+        return None
+
+
+class _NetlinkSource:
+    """Process exec / exit events from the kernel proc connector."""
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_CONNECTOR)
+        try:
+            self.sock.bind((os.getpid(), CN_IDX_PROC))
+            payload = struct.pack("=I", PROC_CN_MCAST_LISTEN)
+            cn_msg = CN_MSG.pack(CN_IDX_PROC, CN_VAL_PROC, 0, 0, len(payload), 0) + payload
+            header = NLMSGHDR.pack(NLMSGHDR.size + len(cn_msg), 3, 0, 0, os.getpid())  # NLMSG_DONE
+            self.sock.send(header + cn_msg)
+        except OSError:
+            self.sock.close()
+            raise
+        self.sock.setblocking(False)
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def read_events(self):
+        """Returns (exec tgids, exit tgids); raises OSError when events were lost."""
+        started, exited = set(), set()
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except BlockingIOError:
+                return started, exited
+            offset = NLMSGHDR.size + CN_MSG.size
+            if len(data) < offset + PROC_EVENT.size + EVENT_PIDS.size:
+                continue
+            what, _, _ = PROC_EVENT.unpack_from(data, offset)
+            pid, tgid = EVENT_PIDS.unpack_from(data, offset + PROC_EVENT.size)
+            if pid != tgid:
+                continue  # a thread, not a process
+            if what == PROC_EVENT_EXEC:
+                started.add(tgid)
+            elif what == PROC_EVENT_EXIT:
+                exited.add(tgid)
+
+    def close(self):
+        self.sock.close()
+
+
+class ProcessWatcher:
+    def __init__(self, use_netlink=True, proc_root=PROC_ROOT):
+        self.proc_root = proc_root
+        self.known = {}  # pid -> (identity, create_time)
+        self.netlink = None
+        self.scan_proc = platform.system() == "Linux" and os.path.isdir(proc_root)
+
+        if use_netlink and self.scan_proc and hasattr(socket, "AF_NETLINK"):
+            try:
+                self.netlink = _NetlinkSource()
+            except OSError as e:
+                log.info("Proc connector not available (%s), scanning %s", e, proc_root)
+
+        self.source = "netlink" if self.netlink else ("proc" if self.scan_proc else "psutil")
+        self.polls = 0
+        self.full_scans = 0
+        self._primed = False
+
+    def _snapshot(self):
+        """pid -> identity for every running process, identity changes on PID reuse."""
+        self.full_scans += 1
+        if self.scan_proc:
+            with os.scandir(self.proc_root) as entries:
+                return {int(e.name): e.inode() for e in entries if e.name.isdigit()}
+        return {pid: None for pid in psutil.pids()}
+
+    def _diff(self, current):
+        new, exited = [], []
+        for pid, (identity, create_time) in list(self.known.items()):
+            if current.get(pid, identity) != identity or pid not in current:
+                exited.append((pid, create_time))
+                del self.known[pid]
+        for pid, identity in current.items():
+            if pid not in self.known:
+                create_time = _create_time(pid)
+                if create_time is None:
+                    continue
+                self.known[pid] = (identity, create_time)
+                new.append((pid, create_time))
+        return new, exited
+
+    def poll(self):
+        """Returns (started, exited) lists of (pid, create_time) since the last poll."""
+        self.polls += 1
+        if self.netlink is None or not self._primed:
+            self._primed = True
+            return self._diff(self._snapshot())
+
+        try:
+            started, ended = self.netlink.read_events()
+        except OSError as e:
+            # ENOBUFS: events were dropped, resync with a full scan
+            log.warning("Proc connector overrun (%s), rescanning", e)
+            return self._diff(self._snapshot())
+
+        new, exited = [], []
+        for pid in ended:
+            if pid in self.known:
+                exited.append((pid, self.known.pop(pid)[1]))
+        for pid in started:
+            create_time = _create_time(pid)
+            if create_time is None:
+                continue
+            old = self.known.get(pid)
+            if old is not None and old[1] == create_time:
+                continue  # exec() in a process we already track
+            if old is not None:
+                exited.append((pid, old[1]))
+            self.known[pid] = (None, create_time)
+            new.append((pid, create_time))
+        return new, exited
+
+    def wait(self, timeout):
+        """Sleep up to timeout, returns early when process events arrive."""
+        if self.netlink is None:
+            time.sleep(timeout)
+            return
+        select.select([self.netlink], [], [], timeout)
+
+    def close(self):
+        if self.netlink is not None:
+            self.netlink.close()
+            self.netlink = None
+
+    def stats(self):
+        return {
+            "source": self.source,
+            "tracked": len(self.known),
+            "polls": self.polls,
+            "full_scans": self.full_scans,
+        }
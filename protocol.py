@@ -0,0 +1,367 @@
+import logging
+import json
+import struct
+import zlib
+
+log = logging.getLogger(__name__)
+
+# -----------------------------
+# Wire protocol
+# -----------------------------
+# "json" is the original newline delimited JSON link.
+# "bin1" is a framed binary link, offered by the host during the handshake
+# and only used when the board answers that it speaks it too.
+#
+# bin1 frame layout (little endian):
+#   SYNC (2) | type (u8) | payload length (u16) | payload | crc32 (u32)
+# the crc32 covers type, length and payload and uses the same IEEE
+# parameters as config_IEEE in icons.py (zlib.crc32).
+
+PROTOCOL_JSON = "json"
+PROTOCOL_BINARY = "bin1"
+
+SYNC = b"\xa5\x5a"
+HEADER = struct.Struct("<2sBH")
+CRC = struct.Struct("<I")
+MAX_PAYLOAD = 4096
+
+FRAME_MESSAGE = 0x01  # dict encoded as (field id, value) pairs
+FRAME_RAW = 0x02      # raw bytes, e.g. icon chunks
+FRAME_JSON = 0x03     # dict that has keys outside of FIELDS, sent as JSON
+FRAME_CHUNK = 0x04    # u16 sequence number + bulk data (windowed icon transfer)
+
+CHUNK_SEQ = struct.Struct("<H")
+
+# field id, key, value type
+FIELDS = (
+    # host -> device, slow telemetry
+    (1, "OSName", "str"),
+    (2, "time", "str"),
+    (3, "date", "str"),
+    (4, "cpuUsage", "u8"),
+    (5, "cpuTemp", "i16"),
+    (6, "memMax", "u32"),
+    (7, "MemUsage", "u32"),
+    (8, "batteryPercent", "u8"),
+    (9, "powerIn", "bool"),
+    # host -> device, fast telemetry
+    (10, "volume", "u8"),
+    (11, "brightness", "u8"),
+    # device -> host
+    (32, "command", "str"),
+    (33, "setVolume", "u8"),
+    (34, "setBrightness", "u8"),
+    # icon transfer
+    (48, "new_app", "str"),
+    (49, "height", "u16"),
+    (50, "width", "u16"),
+    (51, "size", "u32"),
+    (52, "crc", "u32"),
+    (53, "score", "f32"),
+    (54, "waiting_for_icon", "bool"),
+    (55, "done", "str"),
+    (56, "ack", "u16"),  # windowed transfer: next chunk the board expects
+)
+
+VALUE_TYPES = {
+    "u8": struct.Struct("<B"),
+    "u16": struct.Struct("<H"),
+    "u32": struct.Struct("<I"),
+    "i16": struct.Struct("<h"),
+    "f32": struct.Struct("<f"),
+    "bool": struct.Struct("<?"),
+}
+
+FIELDS_BY_KEY = {key: (field_id, kind) for field_id, key, kind in FIELDS}
+FIELDS_BY_ID = {field_id: (key, kind) for field_id, key, kind in FIELDS}
+
+
+class FrameError(ValueError):
+    """Raised when a frame or field payload can not be decoded."""
+
+
+# ------------ Frames ------------
+
+
+def frame_crc(frame_type, payload):
+    return zlib.crc32(struct.pack("<BH", frame_type, len(payload)) + payload)
+
+
+def encode_frame(frame_type, payload):
+    payload = bytes(payload)
+    if len(payload) > MAX_PAYLOAD:
+        raise FrameError(f"payload too large: {len(payload)} bytes")
+    return (HEADER.pack(SYNC, frame_type, len(payload))
+            + payload
+            + CRC.pack(frame_crc(frame_type, payload)))
+
+
+def decode_frame(buf):
+    """
+    Decode one frame from the start of buf.
+    Returns (frame_type, payload, consumed) or None if buf holds only part of a frame.
+    """
+    if len(buf) < HEADER.size:
+        return None
+    sync, frame_type, length = HEADER.unpack_from(buf)
+    if sync != SYNC:
+        raise FrameError("bad sync")
+    if length > MAX_PAYLOAD:
+        raise FrameError(f"bad length: {length}")
+    end = HEADER.size + length
+    if len(buf) < end + CRC.size:
+        return None
+    payload = bytes(buf[HEADER.size:end])
+    (crc,) = CRC.unpack_from(buf, end)
+    if crc != frame_crc(frame_type, payload):
+        raise FrameError("bad crc")
+    return frame_type, payload, end + CRC.size
+
+
+# ------------ Fields ------------
+
+
+def encode_fields(msg):
+    """Encode a dict as (field id, value) pairs. None values are skipped."""
+    out = bytearray()
+    for key, value in msg.items():
+        if value is None:
+            continue
+        field_id, kind = FIELDS_BY_KEY[key]
+        out.append(field_id)
+        if kind == "str":
+            raw = str(value).encode("utf-8")[:255]
+            out.append(len(raw))
+            out += raw
+        elif kind == "f32":
+            out += VALUE_TYPES[kind].pack(float(value))
+        elif kind == "bool":
+            out += VALUE_TYPES[kind].pack(bool(value))
+        else:
+            out += VALUE_TYPES[kind].pack(int(value))
+    return bytes(out)
+
+
+def decode_fields(payload):
+    msg = {}
+    i = 0
+    try:
+        while i < len(payload):
+            key, kind = FIELDS_BY_ID[payload[i]]
+            i += 1
+            if kind == "str":
+                length = payload[i]
+                msg[key] = payload[i + 1:i + 1 + length].decode("utf-8")
+                i += 1 + length
+            else:
+                value_type = VALUE_TYPES[kind]
+                (msg[key],) = value_type.unpack_from(payload, i)
+                i += value_type.size
+    except (KeyError, IndexError, struct.error, UnicodeDecodeError) as e:
+        raise FrameError(f"bad field payload: {e}") from e
+    return msg
+
+
+def encode_message(msg):
+    if all(key in FIELDS_BY_KEY for key in msg):
+        return encode_frame(FRAME_MESSAGE, encode_fields(msg))
+    return encode_frame(FRAME_JSON, json.dumps(msg).encode("utf-8"))
+
+
+def decode_message(frame_type, payload):
+    if frame_type == FRAME_MESSAGE:
+        return decode_fields(payload)
+    if frame_type == FRAME_JSON:
+        return json.loads(payload.decode("utf-8"))
+    if frame_type == FRAME_RAW:
+        return payload
+    if frame_type == FRAME_CHUNK:
+        if len(payload) < CHUNK_SEQ.size:
+            raise FrameError("short chunk")
+        (seq,) = CHUNK_SEQ.unpack_from(payload)
+        return {"seq": seq, "chunk": payload[CHUNK_SEQ.size:]}
+    raise FrameError(f"unknown frame type: {frame_type}")
+
+
+# ------------ Stream decoding ------------
+
+MAX_ERRORS = 15
+MAX_LINE = 65536  # a JSON line longer than this is garbage
+
+
+class StreamDecoder:
+    """
+    Incremental decoder for the incoming byte stream.
+    feed() takes whatever one read returned and gives back every complete
+    message in it; partial data is kept for the next read. Bad lines / frames
+    are skipped and the decoder resyncs on the next newline / sync word.
+    More than max_errors bad frames in a row raise FrameError, the link is
+    then considered broken.
+    """
+
+    def __init__(self, protocol=PROTOCOL_JSON, max_errors=MAX_ERRORS):
+        self.protocol = protocol
+        self.max_errors = max_errors
+        self.buffer = bytearray()
+        self.error_run = 0
+
+        self.reads = 0
+        self.frames = 0
+        self.errors = 0
+        self.resyncs = 0
+        self.max_frames_per_read = 0
+        self.frames_per_read = {}  # frames in one read -> number of reads
+
+    def feed(self, data):
+        self.buffer += data
+        if self.protocol == PROTOCOL_BINARY:
+            messages = self._split_frames()
+        else:
+            messages = self._split_lines()
+
+        self.reads += 1
+        self.frames += len(messages)
+        self.max_frames_per_read = max(self.max_frames_per_read, len(messages))
+        self.frames_per_read[len(messages)] = self.frames_per_read.get(len(messages), 0) + 1
+        return messages
+
+    def _error(self, reason):
+        self.errors += 1
+        self.error_run += 1
+        log.debug("Invalid message: %s", reason)
+        if self.error_run > self.max_errors:
+            raise FrameError(f"{self.error_run} bad frames in a row")
+
+    def _split_lines(self):
+        messages = []
+        start = 0
+        while True:
+            end = self.buffer.find(b"\n", start)
+            if end < 0:
+                break
+            line = bytes(self.buffer[start:end]).strip()
+            start = end + 1
+            if not line:
+                continue
+            try:
+                messages.append(json.loads(line.decode("utf-8")))
+                self.error_run = 0
+            except ValueError:
+                self._error(line[:80])
+        del self.buffer[:start]
+
+        if len(self.buffer) > MAX_LINE:
+            self.buffer.clear()
+            self.resyncs += 1
+            self._error("line too long")
+        return messages
+
+    def _split_frames(self):
+        messages = []
+        while True:
+            start = self.buffer.find(SYNC)
+            if start < 0:
+                # keep a trailing first sync byte, the rest is garbage
+                keep = 1 if self.buffer.endswith(SYNC[:1]) else 0
+                if len(self.buffer) > keep:
+                    self.resyncs += 1
+                    del self.buffer[:len(self.buffer) - keep]
+                break
+            if start > 0:
+                self.resyncs += 1
+                del self.buffer[:start]
+
+            try:
+                decoded = decode_frame(self.buffer)
+            except ValueError as e:
+                # drop this sync word and look for the next one
+                del self.buffer[:len(SYNC)]
+                self._error(e)
+                continue
+            if decoded is None:
+                break
+            frame_type, payload, consumed = decoded
+            del self.buffer[:consumed]
+            try:
+                messages.append(decode_message(frame_type, payload))
+                self.error_run = 0
+            except ValueError as e:
+                # a valid frame with a message we can't read, already consumed
+                self._error(e)
+        return messages
+
+    def stats(self):
+        return {
+            "reads": self.reads,
+            "frames": self.frames,
+            "errors": self.errors,
+            "resyncs": self.resyncs,
+            "max_frames_per_read": self.max_frames_per_read,
+            "frames_per_read": dict(sorted(self.frames_per_read.items())),
+        }
+
+
+# ------------ Codecs ------------
+
+
+class JsonCodec:
+    name = PROTOCOL_JSON
+
+    def encode(self, msg):
+        return (json.dumps(msg) + "\n").encode("utf-8")
+
+    def encode_raw(self, data):
+        return bytes(data)
+
+    def decoder(self, max_errors=MAX_ERRORS):
+        return StreamDecoder(PROTOCOL_JSON, max_errors)
+
+    def read_message(self, port):
+        """Read one message from the port, None if nothing arrived."""
+        data = port.read_until(b"\n").decode("utf-8").strip()
+        if not data:
+            return None
+        return json.loads(data)
+
+
+class BinaryCodec:
+    name = PROTOCOL_BINARY
+
+    def encode(self, msg):
+        return encode_message(msg)
+
+    def encode_raw(self, data):
+        data = bytes(data)
+        return b"".join(encode_frame(FRAME_RAW, data[i:i + MAX_PAYLOAD])
+                        for i in range(0, len(data), MAX_PAYLOAD))
+
+    def decoder(self, max_errors=MAX_ERRORS):
+        return StreamDecoder(PROTOCOL_BINARY, max_errors)
+
+    def encode_chunk(self, seq, data):
+        return encode_frame(FRAME_CHUNK, CHUNK_SEQ.pack(seq & 0xFFFF) + bytes(data))
+
+    def read_message(self, port):
+        """Read one message from the port, None if nothing arrived."""
+        # hunt for the sync word so a garbage byte only costs one frame
+        head = port.read(1)
+        if head != SYNC[:1]:
+            return None
+        head += port.read(HEADER.size - 1)
+        if len(head) < HEADER.size or head[:2] != SYNC:
+            return None
+        _, _, length = HEADER.unpack(head)
+        if length > MAX_PAYLOAD:
+            raise FrameError(f"bad length: {length}")
+        frame = head + port.read(length + CRC.size)
+        decoded = decode_frame(frame)
+        if decoded is None:
+            raise FrameError("frame timed out")
+        frame_type, payload, _ = decoded
+        return decode_message(frame_type, payload)
+
+
+def get_codec(protocol):
+    if protocol == PROTOCOL_BINARY:
+        return BinaryCodec()
+    return JsonCodec()
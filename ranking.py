@@ -0,0 +1,155 @@
+import logging
+import math
+import time
+import threading
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+# -----------------------------
+# App ranking with exponential decay
+# -----------------------------
+# Every launch adds 1 to an app's score and the score halves every
+# HALF_LIFE seconds:  score(t) = sum(exp(-(t - t_launch) / tau)).
+# Kept in the log domain as  key = ln(sum(exp(t_launch / tau))),  so
+# score(t) = exp(key - t / tau). The key does not change with time, only on a
+# launch, so the order of apps never has to be recomputed while time passes,
+# and a launch touches only the launched app and the top list.
+
+HALF_LIFE = 3 * 24 * 3600  # seconds
+TOP_K = 12
+
+_TAU = HALF_LIFE / math.log(2)
+
+
+def _logaddexp(a, b):
+    if a is None:
+        return b
+    hi, lo = (a, b) if a >= b else (b, a)
+    return hi + math.log1p(math.exp(lo - hi))
+
+
+def key_from_history(times_run, last_run, tau=_TAU):
+    """Key for registry entries from before the ranking, all runs counted at last_run."""
+    if not times_run or not last_run:
+        return None
+    try:
+        t = datetime.fromisoformat(last_run).timestamp()
+    except (TypeError, ValueError):
+        return None
+    return t / tau + math.log(times_run)
+
+
+class AppRanking:
+    """
+    Ranks apps by decayed launch count. record_launch() is O(log k) for the
+    top list plus O(1) for the app, top() is a copy of the maintained list.
+    Listeners are called with the new top list only when its members or their
+    order change.
+    """
+
+    def __init__(self, k=TOP_K, half_life=HALF_LIFE):
+        self.k = k
+        self.tau = half_life / math.log(2)
+        self._lock = threading.Lock()
+        self._keys = {}  # name -> key
+        self._top = []   # names, best first, at most k
+        self._listeners = []
+
+        self.launches = 0
+        self.changes = 0
+
+    def load(self, entries):
+        """Seed from registry entries {name: entry}, uses "rank_key" when stored."""
+        with self._lock:
+            for name, entry in entries.items():
+                key = entry.get("rank_key")
+                if key is None:
+                    key = key_from_history(entry.get("times_run", 0), entry.get("last_run"), self.tau)
+                if key is not None:
+                    self._keys[name] = key
+            self._rebuild()
+
+    def add_listener(self, callback):
+        self._listeners.append(callback)
+
+    def _sort_key(self, name):
+        return (-self._keys[name], name)
+
+    def _rebuild(self):
+        self._top = sorted(self._keys, key=self._sort_key)[:self.k]
+
+    def record_launch(self, name, when=None):
+        """Count a launch at time.time() (or when), returns the app's new key."""
+        when = time.time() if when is None else when
+        with self._lock:
+            old_top = list(self._top)
+            key = _logaddexp(self._keys.get(name), when / self.tau)
+            self._keys[name] = key
+            self.launches += 1
+
+            # keys only grow on a launch, so only this app can move up
+            if name in self._top:
+                self._top.remove(name)
+            elif len(self._top) == self.k:
+                if self._sort_key(name) > self._sort_key(self._top[-1]):
+                    return key
+                self._top.pop()
+            lo, hi = 0, len(self._top)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if self._sort_key(self._top[mid]) < self._sort_key(name):
+                    lo = mid + 1
+                else:
+                    hi = mid
+            self._top.insert(lo, name)
+
+            changed = self._top != old_top
+            top = list(self._top)
+            if changed:
+                self.changes += 1
+        if changed:
+            self._notify(top)
+        return key
+
+    def remove(self, name):
+        with self._lock:
+            if self._keys.pop(name, None) is None:
+                return
+            changed = name in self._top
+            if changed:
+                self._rebuild()
+                self.changes += 1
+            top = list(self._top)
+        if changed:
+            self._notify(top)
+
+    def _notify(self, top):
+        for callback in self._listeners:
+            try:
+                callback(top)
+            except Exception as e:
+                log.error("Top apps listener failed: %s", e)
+
+    def top(self, limit=None):
+        with self._lock:
+            if limit is None or limit <= self.k:
+                return self._top[:limit]
+            return sorted(self._keys, key=self._sort_key)[:limit]
+
+    def score(self, name, now=None):
+        """Decayed launch count of an app at now (time.time() by default)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            key = self._keys.get(name)
+        if key is None:
+            return 0.0
+        return math.exp(key - now / self.tau)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "apps": len(self._keys),
+                "launches": self.launches,
+                "top_changes": self.changes,
+            }
@@ -0,0 +1,149 @@
+import logging
+import os
+import copy
+import json
+import threading
+
+log = logging.getLogger(__name__)
+
+COMPACT_EVERY = 200  # journal records before the snapshot is rewritten
+
+
+class RegistryStore:
+    """
+    App registry kept in memory, persisted as
+    - apps.json          snapshot, same format as before (indent=2)
+    - apps.json.journal  one JSON record per change, appended after the snapshot
+    An update appends one short line instead of rewriting the whole file.
+    Every compact_every records (and on close) the snapshot is rewritten to a
+    temp file and moved into place with os.replace, so a reader or a crash
+    never sees a half-written apps.json; a torn last journal line is ignored.
+    """
+
+    def __init__(self, path, compact_every=COMPACT_EVERY):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        self._data = {}
+        self._journal = None
+        self._records = 0
+
+        self.writes = 0
+        self.compactions = 0
+        self._load()
+
+    # ------------ Loading ------------
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as f:
+                self._data = json.load(f)
+
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        log.warning("Ignoring torn registry journal record")
+                        break
+                    self._apply(record)
+                    self._records += 1
+            if self._records:
+                self.compact()
+
+    def _apply(self, record):
+        if record["op"] == "put":
+            self._data[record["key"]] = record["value"]
+        elif record["op"] == "del":
+            self._data.pop(record["key"], None)
+
+    # ------------ Reads ------------
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            return copy.deepcopy(entry) if entry is not None else default
+
+    def keys(self):
+        with self._lock:
+            return list(self._data)
+
+    def snapshot(self):
+        """Deep copy of the whole registry, callers may change it freely."""
+        with self._lock:
+            return copy.deepcopy(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    # ------------ Writes ------------
+
+    def _append(self, record):
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+        self._journal.write(json.dumps(record) + "\n")
+        self._journal.flush()
+        self._apply(record)
+        self._records += 1
+        self.writes += 1
+        if self._records >= self.compact_every:
+            self.compact()
+
+    def put(self, key, entry):
+        with self._lock:
+            self._append({"op": "put", "key": key, "value": copy.deepcopy(entry)})
+
+    def delete(self, key):
+        with self._lock:
+            if key in self._data:
+                self._append({"op": "del", "key": key})
+
+    def replace_all(self, registry):
+        """Store a whole registry dict, only changed entries are journaled."""
+        with self._lock:
+            for key in [k for k in self._data if k not in registry]:
+                self.delete(key)
+            for key, entry in registry.items():
+                if self._data.get(key) != entry:
+                    self.put(key, entry)
+
+    def compact(self):
+        with self._lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._data, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
+            if os.path.exists(self.journal_path):
+                os.remove(self.journal_path)
+            self._records = 0
+            self.compactions += 1
+
+    def close(self):
+        with self._lock:
+            if self._records:
+                self.compact()
+            elif self._journal is not None:
+                self._journal.close()
+                self._journal = None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._data),
+                "writes": self.writes,
+                "journal_records": self._records,
+                "compactions": self.compactions,
+            }
@@ -1,6 +1,6 @@
+import logging
 from datetime import datetime
 import time
-import json
 import socket
 import platform
 
@@ -8,57 +8,111 @@ import serial
 import serial.tools.list_ports
 
 from audio import get_volume
-from Systeminfo.system_Info import SystemInfo
-import screen_brightness_control as sbc
+from protocol import PROTOCOL_JSON, PROTOCOL_BINARY
+from brightness import get_brightness
+from telemetry import TelemetrySampler
 
 import psutil      # for cpu/mem usage
 
-system_info = SystemInfo()
-info = system_info.get_all_info()
+log = logging.getLogger(__name__)
+
+SERIAL_BAUD = 460800
+SERIAL_READ_TIMEOUT = 0.1  # seconds a read may block, bounds how long a teardown waits for the reader
+
+# opening the port resets the ESP32, so the hello is repeated every
+# HANDSHAKE_RETRY seconds until the firmware is up and answers
+HANDSHAKE_TIMEOUT = 3.0
+HANDSHAKE_RETRY = 0.25
+BOOT_OUTPUT_LIMIT = 4096  # bytes of boot banner kept for the debug log
+
+# seconds between samples of each slow telemetry metric
+CPU_USAGE_INTERVAL = 0.5
+MEMORY_INTERVAL = 1
+CPU_TEMP_INTERVAL = 2
+BATTERY_INTERVAL = 5
+
+
+def open_serial_port(device):
+    """Open the board's port, None if it can't be opened (yet)."""
+    try:
+        return serial.Serial(device, SERIAL_BAUD, timeout=SERIAL_READ_TIMEOUT)
+    except (serial.SerialException, OSError) as e:
+        log.error("Error opening %s: %s", device, e)
+        return None
 
 
 def find_serial_port(serial_chip_vid, serial_chip_pid):
     ports = serial.tools.list_ports.comports()
     for port in ports:
         if port.vid == serial_chip_vid and port.pid == serial_chip_pid:
-            print(f"found esp32 on {port}")
-            try:
-                port_connected = serial.Serial(port.device, 460800, timeout=2)
-                time.sleep(1)  # allow ESP32 reset after open
-                return port_connected
-            except Exception as e:
-                print(f"Error: {e}")
-                return None
-    print("port not found")
+            log.info("found esp32 on %s", port)
+            return open_serial_port(port.device)
+    log.debug("port not found")
     return None
 
 
-def serial_handshake(port):
+def serial_handshake(port, offer_binary=False):
+    """
+    Returns the agreed protocol (PROTOCOL_JSON / PROTOCOL_BINARY) or False.
+    The binary protocol is offered as "host_ok bin1"; boards that answer with
+    plain "ESP32_ok" keep using JSON.
+    The hello is sent right away and repeated every HANDSHAKE_RETRY seconds,
+    and once more as soon as the boot banner of a resetting board has ended.
+    Reads block in the driver for up to the port timeout, nothing is polled.
+    """
     if port is None:
-        print("Handshake failed: Port is None")
+        log.error("Handshake failed: Port is None")
         return False
 
+    hello = b"host_ok " + PROTOCOL_BINARY.encode() if offer_binary else b"host_ok"
+    start = time.monotonic()
+    data = b""
+    pings = 0
+    booting = False
     try:
-        # Create JSON handshake message
         port.read_all()
-        port.write(b"host_ok")
-        port.flush()
-
-        start = time.time()
-        while time.time() - start < 2:  # 2 second timeout
-            if port.in_waiting:
-                data = port.read_all()
-                print(f"Received raw data: {data}")
-
-                if b"ESP32_ok" in data:
-                    print("Handshake successful (raw)")
-                    return True
-            time.sleep(0.01)
+        next_ping = start
+        while True:
+            now = time.monotonic()
+            if now - start >= HANDSHAKE_TIMEOUT:
+                break
+            if now >= next_ping:
+                port.write(hello)
+                port.flush()
+                pings += 1
+                next_ping = now + HANDSHAKE_RETRY
+
+            chunk = port.read(max(1, port.in_waiting))
+            if not chunk:
+                if booting:
+                    # the boot output went quiet: the firmware is up, ask now
+                    booting = False
+                    next_ping = now
+                continue
+            data = (data + chunk)[-BOOT_OUTPUT_LIMIT:]
+            if b"ESP32_ok" not in data:
+                booting = True
+                continue
+
+            if offer_binary:
+                # the " bin1" of the answer may still be on its way
+                suffix = b" " + PROTOCOL_BINARY.encode()
+                tail = data.split(b"ESP32_ok", 1)[1]
+                if len(tail) < len(suffix) and suffix.startswith(tail):
+                    data += port.read(len(suffix) - len(tail))
+            log.debug("Received raw data: %r", data)
+            elapsed = time.monotonic() - start
+            if offer_binary and PROTOCOL_BINARY.encode() in data:
+                log.info("Handshake successful (binary) after %.3f s, %d hello(s)", elapsed, pings)
+                return PROTOCOL_BINARY
+            log.info("Handshake successful (raw) after %.3f s, %d hello(s)", elapsed, pings)
+            return PROTOCOL_JSON
 
     except Exception as e:
-        print(f"Handshake error: {e}")
+        log.error("Handshake error: %s", e)
+        return False
 
-    print("Handshake timed out")
+    log.warning("Handshake timed out after %d hello(s), board said %r", pings, data[-200:])
     return False
 
 
@@ -125,6 +179,20 @@ def get_cpu_temp():
     return 0
 
 
+def get_memory():
+    """(total MB, used MB) from one virtual_memory() call."""
+    mem = psutil.virtual_memory()
+    return int(mem.total / (1024*1024)), int(mem.used / (1024*1024))
+
+
+def get_battery():
+    """(percent, plugged in), None on machines without a battery."""
+    battery = psutil.sensors_battery()
+    if battery is None:
+        return None
+    return int(battery.percent), bool(battery.power_plugged)
+
+
 def get_date_time():
     now = datetime.now()
 
@@ -133,35 +201,48 @@ def get_date_time():
     current_time = now.strftime("%H:%M:%S")   # e.g. "18:47:12"
     return current_date, current_time
 
+
+# ------------ Telemetry sampler ------------
+
+telemetry = TelemetrySampler()
+telemetry.add("OSName", platform.system, default="")
+telemetry.add("cpuUsage", lambda: int(psutil.cpu_percent()), CPU_USAGE_INTERVAL, default=0)
+telemetry.add("cpuTemp", get_cpu_temp, CPU_TEMP_INTERVAL, default=0)
+telemetry.add("memory", get_memory, MEMORY_INTERVAL, default=(0, 0))
+telemetry.add("battery", get_battery, BATTERY_INTERVAL)
+
 # ------------ Build message ------------
 
 
 def build_slow_message():
     current_date, current_time = get_date_time()
-    battery = psutil.sensors_battery()
+    snapshot = telemetry.snapshot()
+    mem_max, mem_used = snapshot["memory"]
     msg = {
         # String values
-        "OSName": platform.system(),
+        "OSName": snapshot["OSName"],
         "time": current_time,
         "date": current_date,
 
         # Int values
-        "cpuUsage": int(psutil.cpu_percent()),
-        "cpuTemp": get_cpu_temp(),
-        "memMax": int(psutil.virtual_memory().total / (1024*1024)),   # MB
-        "MemUsage": int(psutil.virtual_memory().used / (1024*1024)),  # MB
-
-        "batteryPercent": battery.percent,
-        "powerIn": battery.power_plugged,
+        "cpuUsage": snapshot["cpuUsage"],
+        "cpuTemp": snapshot["cpuTemp"],
+        "memMax": mem_max,   # MB
+        "MemUsage": mem_used,  # MB
         # "internet": is_internet_reachable(),
         # "interfaces": network_snapshot()
     }
-    return json.dumps(msg)
+
+    # desktops have no battery, the keys are left out
+    battery = snapshot["battery"]
+    if battery is not None:
+        msg["batteryPercent"], msg["powerIn"] = battery
+    return msg
 
 
 def build_fast_messege():
     msg = {
         "volume": get_volume(),
-        "brightness": int(sbc.get_brightness(display=0)[0]),
+        "brightness": get_brightness(),
     }
-    return json.dumps(msg)
+    return msg
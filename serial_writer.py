@@ -0,0 +1,197 @@
+import logging
+import time
+import heapq
+import threading
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# -----------------------------
+# Priority classes, lower goes first
+# -----------------------------
+PRIORITY_INTERACTIVE = 0  # replies to something the user just did on the board
+PRIORITY_FAST = 1         # volume / brightness telemetry
+PRIORITY_SLOW = 2         # cpu / mem / battery telemetry
+PRIORITY_BULK = 3         # icon offers and icon chunks
+
+PRIORITY_NAMES = {
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_FAST: "fast",
+    PRIORITY_SLOW: "slow",
+    PRIORITY_BULK: "bulk",
+}
+
+WRITE_SECONDS = metrics.histogram("serial_write_seconds", "port.write + flush time per frame", ("priority",))
+QUEUE_WAIT_SECONDS = metrics.histogram("writer_queue_wait_seconds", "Time a frame waited in the writer queue", ("priority",))
+LOCK_WAIT_SECONDS = metrics.histogram("writer_lock_wait_seconds", "Time submit() waited for the writer lock")
+BYTES_WRITTEN = metrics.counter("serial_bytes_written_total", "Bytes written to the port", ("priority",))
+
+BULK_CHUNK_SIZE = 512
+BULK_PACE = 0.01  # seconds between bulk chunks, gives the ESP32 time to store them
+
+
+class SerialWriter:
+    """
+    The only thing that writes to the port. Producers submit() encoded frames
+    with a priority class and the writer thread drains them in priority order,
+    FIFO inside a class. Bulk payloads are split so urgent frames can be sent
+    between chunks, and bulk chunks are paced without blocking other classes.
+    Unframed payloads (raw icon bytes on the JSON link) are queued as one
+    exclusive burst instead, nothing else is written until its last chunk;
+    hold() keeps the other classes off the link before such a burst.
+    """
+
+    def __init__(self, port, chunk_size=BULK_CHUNK_SIZE, bulk_pace=BULK_PACE):
+        self.port = port
+        self.chunk_size = chunk_size
+        self.bulk_pace = bulk_pace
+
+        self._heap = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._running = True
+        self._bulk_ready = 0.0
+        self._held = None  # only this class is written while set
+
+        self.depth = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.sent = {name: 0 for name in PRIORITY_NAMES.values()}
+        self.wait_total = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.wait_max = {name: 0.0 for name in PRIORITY_NAMES.values()}
+        self.bytes_written = 0
+        self.error = None
+        self.first_telemetry_at = None  # time.monotonic() of the first fast / slow frame
+
+    def submit(self, data, priority=PRIORITY_SLOW, paced=True):
+        """paced=False skips the bulk pacing, for transfers with their own flow control."""
+        start = time.perf_counter()
+        with self._cond:
+            LOCK_WAIT_SECONDS.observe(time.perf_counter() - start)
+            self._push(data, priority, paced)
+            self._cond.notify()
+
+    def submit_bulk(self, data, encode=bytes, trailer=None, exclusive=False):
+        """
+        Queue a large payload as chunk_size pieces, each passed through encode(),
+        and then trailer (an encoded frame) if given. exclusive=True writes the
+        pieces and trailer back to back (still paced), for payloads the board
+        reads by length, where any frame in between would end up in the data.
+        An exclusive burst ends a hold() once it is written.
+        """
+        chunks = [encode(data[i:i + self.chunk_size]) for i in range(0, len(data), self.chunk_size)]
+        if trailer is not None:
+            chunks.append(trailer)
+        with self._cond:
+            if exclusive:
+                self._push(chunks, PRIORITY_BULK)
+            else:
+                for chunk in chunks:
+                    self._push(chunk, PRIORITY_BULK)
+            self._cond.notify()
+
+    def hold(self, priority=PRIORITY_BULK):
+        """Write only this class until release() or the next exclusive burst is written."""
+        with self._cond:
+            self._held = priority
+
+    def release(self):
+        with self._cond:
+            self._held = None
+            self._cond.notify()
+
+    def pending(self, priority):
+        """Number of frames of this class still waiting to be written."""
+        with self._cond:
+            return self.depth[PRIORITY_NAMES[priority]]
+
+    def _push(self, data, priority, paced=True):
+        heapq.heappush(self._heap, (priority, self._seq, time.monotonic(), data, paced))
+        self._seq += 1
+        self.depth[PRIORITY_NAMES[priority]] += 1
+
+    def _next(self):
+        with self._cond:
+            while self._running:
+                index = self._first()
+                if index is not None:
+                    priority, paced = self._heap[index][0], self._heap[index][4]
+                    wait = self._bulk_ready - time.monotonic()
+                    if priority != PRIORITY_BULK or not paced or wait <= 0:
+                        item = self._heap[index]
+                        if index == 0:
+                            heapq.heappop(self._heap)
+                        else:
+                            self._heap.pop(index)
+                            heapq.heapify(self._heap)
+                        self.depth[PRIORITY_NAMES[priority]] -= 1
+                        return item
+                    self._cond.wait(wait)
+                else:
+                    self._cond.wait()
+            return None
+
+    def _first(self):
+        # heap index of the next frame to write, None if there is none
+        if not self._heap:
+            return None
+        if self._held is None or self._heap[0][0] == self._held:
+            return 0
+        held = [i for i, item in enumerate(self._heap) if item[0] == self._held]
+        return min(held, key=lambda i: self._heap[i][1]) if held else None
+
+    def run(self):
+        while True:
+            item = self._next()
+            if item is None:
+                return
+            priority, _, queued_at, data, paced = item
+            name = PRIORITY_NAMES[priority]
+
+            waited = time.monotonic() - queued_at
+            QUEUE_WAIT_SECONDS.labels(name).observe(waited)
+            self.wait_total[name] += waited
+            self.wait_max[name] = max(self.wait_max[name], waited)
+            self.sent[name] += 1
+
+            # an exclusive burst is a list of chunks, written without a break
+            burst = data if isinstance(data, list) else [data]
+            for i, chunk in enumerate(burst):
+                if i:
+                    time.sleep(self.bulk_pace)
+                    if not self._running:
+                        return
+                try:
+                    with WRITE_SECONDS.labels(name).time():
+                        self.port.write(chunk)
+                        self.port.flush()
+                except Exception as e:
+                    log.error("Serial write error: %s", e)
+                    self.error = e
+                    self.stop()
+                    return
+                self.bytes_written += len(chunk)
+                BYTES_WRITTEN.labels(name).inc(len(chunk))
+            if isinstance(data, list):
+                self.release()
+            if self.first_telemetry_at is None and priority in (PRIORITY_FAST, PRIORITY_SLOW):
+                self.first_telemetry_at = time.monotonic()
+
+            if priority == PRIORITY_BULK and paced:
+                self._bulk_ready = time.monotonic() + self.bulk_pace
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                "queue_depth": dict(self.depth),
+                "sent": dict(self.sent),
+                "avg_wait_ms": {name: (self.wait_total[name] / self.sent[name] * 1000
+                                       if self.sent[name] else 0.0)
+                                for name in self.sent},
+                "max_wait_ms": {name: wait * 1000 for name, wait in self.wait_max.items()},
+                "bytes_written": self.bytes_written,
+            }
@@ -0,0 +1,126 @@
+import time
+import logging
+
+import metrics
+
+log = logging.getLogger(__name__)
+
+# -----------------------------
+# Connection supervisor
+# -----------------------------
+# Owns the connect -> session -> teardown cycle. A session (run_session) owns
+# its workers and returns only once all of them are joined, so there is never
+# more than one set alive. After a session or a failed attempt the next try
+# waits with exponential backoff, reset once a session has streamed for
+# STABLE_SESSION seconds. Disconnect-to-streaming time (last session ended ->
+# first telemetry frame of the next one) is measured against RECONNECT_TARGET;
+# when the board was unplugged in between, plug-in-to-streaming time is
+# measured instead, since the time spent unplugged is not the host's.
+
+BACKOFF_MIN = 0.05  # seconds
+BACKOFF_MAX = 2.0
+STABLE_SESSION = 5.0  # seconds of streaming that count as a good connection
+RECONNECT_TARGET = 2.0  # seconds from disconnect to streaming again
+
+RECONNECT_SECONDS = metrics.histogram(
+    "reconnect_seconds", "Disconnect to first telemetry frame of the next session",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0))
+PLUGIN_SECONDS = metrics.histogram(
+    "plugin_seconds", "Board plugged in to first telemetry frame",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0))
+SESSIONS = metrics.counter("sessions_total", "Ended sessions by reason", ("reason",))
+
+
+class Supervisor:
+    """
+    open_port() waits for the board and returns an open port, or None when
+    there is none yet; run_session(port) runs one session and returns its
+    engine (None when the handshake failed). appeared_at() is the
+    time.monotonic() the board was last plugged in, None if unknown.
+    """
+
+    def __init__(self, open_port, run_session, backoff_min=BACKOFF_MIN, backoff_max=BACKOFF_MAX,
+                 target=RECONNECT_TARGET, appeared_at=None):
+        self.open_port = open_port
+        self.run_session = run_session
+        self.appeared_at = appeared_at
+        self.backoff_min = backoff_min
+        self.backoff_max = backoff_max
+        self.target = target
+
+        self.backoff = backoff_min
+        self.disconnected_at = None
+        self.sessions = 0
+        self.reconnects = []  # disconnect-to-streaming seconds
+        self.plugins = []     # plug-in-to-streaming seconds
+        self.over_target = 0
+
+    def _wait(self):
+        time.sleep(self.backoff)
+        self.backoff = min(self.backoff * 2, self.backoff_max)
+
+    def step(self):
+        """One connection attempt, returns the finished engine or None."""
+        port = self.open_port()
+        if port is None:
+            return None  # open_port did the waiting
+
+        try:
+            engine = self.run_session(port)
+        finally:
+            port.close()
+        if engine is None:
+            self._wait()
+            return None
+
+        self.sessions += 1
+        reason = engine.end_reason or "disconnected"
+        SESSIONS.labels(reason).inc()
+        streaming_at = engine.writer.first_telemetry_at
+        plugged_at = self.appeared_at() if self.appeared_at is not None else None
+        if streaming_at is not None and plugged_at is not None and (
+                self.disconnected_at is None or plugged_at > self.disconnected_at):
+            self._measure_plugin(streaming_at - plugged_at)
+        elif streaming_at is not None and self.disconnected_at is not None:
+            self._measure(streaming_at - self.disconnected_at)
+
+        ended_at = time.monotonic()
+        streamed = ended_at - streaming_at if streaming_at is not None else 0.0
+        log.info("Session ended (%s) after %.1f s of streaming", reason, streamed)
+        self.disconnected_at = ended_at
+        if streamed >= STABLE_SESSION:
+            self.backoff = self.backoff_min
+        else:
+            self._wait()
+        return engine
+
+    def _measure(self, seconds):
+        self.reconnects.append(seconds)
+        RECONNECT_SECONDS.observe(seconds)
+        if seconds > self.target:
+            self.over_target += 1
+            log.warning("Reconnect took %.2f s (target %.2f s)", seconds, self.target)
+        else:
+            log.info("Streaming again %.2f s after the disconnect", seconds)
+
+    def _measure_plugin(self, seconds):
+        self.plugins.append(seconds)
+        PLUGIN_SECONDS.observe(seconds)
+        log.info("Streaming %.2f s after the board appeared", seconds)
+
+    def run(self):
+        while True:
+            self.step()
+
+    def stats(self):
+        reconnects = sorted(self.reconnects)
+        plugins = sorted(self.plugins)
+        return {
+            "plugin_median_s": plugins[len(plugins) // 2] if plugins else None,
+            "sessions": self.sessions,
+            "reconnects": len(reconnects),
+            "reconnect_median_s": reconnects[len(reconnects) // 2] if reconnects else None,
+            "reconnect_max_s": reconnects[-1] if reconnects else None,
+            "over_target": self.over_target,
+            "backoff_s": self.backoff,
+        }
@@ -0,0 +1,125 @@
+import logging
+import time
+import threading
+
+log = logging.getLogger(__name__)
+
+# -----------------------------
+# Background telemetry sampler
+# -----------------------------
+# Each metric is a function sampled on its own interval by one background
+# thread, results go into a shared snapshot the message builders read.
+# interval=None samples once (static facts). stats() reports the cost of
+# every metric so slow sensors can be found and given a longer interval.
+
+
+class Metric:
+    def __init__(self, name, sample, interval):
+        self.name = name
+        self.sample = sample
+        self.base_interval = interval
+        self.interval = interval
+        self.next_run = 0.0
+
+        self.samples = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+
+class TelemetrySampler:
+    def __init__(self):
+        self.metrics = {}
+        self._snapshot = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def add(self, name, sample, interval=None, default=None):
+        """Register sample() under name, the snapshot holds default until the first run."""
+        self.metrics[name] = Metric(name, sample, interval)
+        with self._lock:
+            self._snapshot.setdefault(name, default)
+        self._wake.set()
+
+    def set_scale(self, factor):
+        """Sample every periodic metric factor times less often than registered."""
+        for metric in self.metrics.values():
+            if metric.base_interval is not None:
+                metric.interval = metric.base_interval * factor
+        self._wake.set()
+
+    def get(self, name, default=None):
+        with self._lock:
+            return self._snapshot.get(name, default)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._snapshot)
+
+    def _run_metric(self, metric):
+        start = time.perf_counter()
+        try:
+            value = metric.sample()
+        except Exception as e:
+            metric.errors += 1
+            log.warning("Telemetry %s failed: %s", metric.name, e)
+        else:
+            with self._lock:
+                self._snapshot[metric.name] = value
+        elapsed = time.perf_counter() - start
+        metric.samples += 1
+        metric.total_time += elapsed
+        metric.max_time = max(metric.max_time, elapsed)
+
+    def sample_due(self, now=None):
+        """Sample every metric that is due, returns seconds until the next one."""
+        now = time.monotonic() if now is None else now
+        next_due = None
+        for metric in list(self.metrics.values()):
+            if metric.next_run is None:
+                continue  # static, already sampled
+            if metric.next_run <= now:
+                self._run_metric(metric)
+                if metric.interval is None:
+                    metric.next_run = None
+                    continue
+                # fixed schedule, skip missed runs instead of bursting
+                metric.next_run = max(metric.next_run + metric.interval, now)
+            if next_due is None or metric.next_run < next_due:
+                next_due = metric.next_run
+        return None if next_due is None else max(0.0, next_due - time.monotonic())
+
+    def run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            delay = self.sample_due()
+            self._wake.wait(delay)
+
+    def start(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self.run, name="telemetry", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self):
+        return {
+            name: {
+                "interval": m.interval,
+                "samples": m.samples,
+                "errors": m.errors,
+                "avg_ms": m.total_time / m.samples * 1000 if m.samples else 0.0,
+                "max_ms": m.max_time * 1000,
+                "total_ms": m.total_time * 1000,
+            }
+            for name, m in self.metrics.items()
+        }
@@ -0,0 +1,136 @@
+import os
+
+from brightness import BrightnessProvider, SysfsBacklight, find_backlight
+
+
+class StubBackend:
+    """screen_brightness_control stand-in that counts calls."""
+
+    def __init__(self, value=50):
+        self.value = value
+        self.gets = 0
+        self.sets = []
+
+    def get_brightness(self, display=None):
+        self.gets += 1
+        return [self.value]
+
+    def set_brightness(self, value, display=None):
+        self.sets.append((value, display))
+        self.value = value
+
+
+def _backlight(root, name="intel_backlight", brightness=300, max_brightness=600):
+    path = os.path.join(root, name)
+    os.makedirs(path)
+    with open(os.path.join(path, "max_brightness"), "w") as f:
+        f.write(f"{max_brightness}\n")
+    with open(os.path.join(path, "brightness"), "w") as f:
+        f.write(f"{brightness}\n")
+    return path
+
+
+def _set_raw(path, raw):
+    with open(os.path.join(path, "brightness"), "w") as f:
+        f.write(f"{raw}\n")
+
+
+# ------------ sysfs ------------
+
+
+def test_sysfs_backlight_reads_percent(tmp_path):
+    path = _backlight(str(tmp_path))
+    backlight = SysfsBacklight(path)
+    assert backlight.get() == 50
+    _set_raw(path, 600)
+    assert backlight.get() == 100  # the reused handle sees new values
+    backlight.close()
+
+
+def test_find_backlight_skips_broken_devices(tmp_path):
+    os.makedirs(tmp_path / "aaa_broken")  # no brightness files
+    _backlight(str(tmp_path), "bbb_ok", brightness=60, max_brightness=120)
+    backlight = find_backlight(str(tmp_path))
+    assert backlight is not None
+    assert backlight.path.endswith("bbb_ok")
+    backlight.close()
+
+
+def test_find_backlight_missing_root(tmp_path):
+    assert find_backlight(str(tmp_path / "missing")) is None
+
+
+def test_provider_prefers_sysfs(tmp_path):
+    _backlight(str(tmp_path), brightness=150)
+    backend = StubBackend()
+    provider = BrightnessProvider(sysfs_root=str(tmp_path), backend=backend)
+    assert provider.get_brightness() == 25
+    assert backend.gets == 0
+    assert provider.stats()["source"] == "sysfs"
+
+
+# ------------ Backend cache ------------
+
+
+def test_cache_hit_and_miss(tmp_path):
+    backend = StubBackend(40)
+    provider = BrightnessProvider(sysfs_root=str(tmp_path), ttl=60, backend=backend)
+    assert provider.get_brightness() == 40
+    backend.value = 70
+    assert provider.get_brightness() == 40  # cached
+    assert (backend.gets, provider.cache_hits) == (1, 1)
+
+    provider.invalidate()
+    assert provider.get_brightness() == 70
+    assert backend.gets == 2
+
+
+def test_cache_expires(tmp_path):
+    backend = StubBackend(40)
+    provider = BrightnessProvider(sysfs_root=str(tmp_path), ttl=0, backend=backend)
+    provider.get_brightness()
+    provider.get_brightness()
+    assert backend.gets == 2
+    assert provider.cache_hits == 0
+
+
+def test_set_updates_cache_and_all_displays(tmp_path):
+    backend = StubBackend(40)
+    provider = BrightnessProvider(sysfs_root=str(tmp_path), ttl=60, backend=backend)
+    provider.get_brightness()
+    provider.set_brightness(80)
+    assert backend.sets == [(80, None)]
+    assert provider.get_brightness() == 80
+    assert backend.gets == 1
+
+
+class FailingBackend(StubBackend):
+    def __init__(self, value=50):
+        super().__init__(value)
+        self.result = None  # None: raise, else returned as is
+
+    def get_brightness(self, display=None):
+        self.gets += 1
+        if self.result is None:
+            raise RuntimeError("no DDC display")
+        return self.result
+
+
+def test_backend_error_returns_last_value(tmp_path):
+    backend = FailingBackend()
+    backend.result = [30]
+    provider = BrightnessProvider(sysfs_root=str(tmp_path), ttl=0, backend=backend)
+    assert provider.get_brightness() == 30
+    backend.result = None
+    assert provider.get_brightness() == 30
+    backend.result = []
+    assert provider.get_brightness() == 30
+    assert provider.backend_errors == 2
+
+
+def test_backend_error_without_value(tmp_path):
+    backend = FailingBackend()
+    provider = BrightnessProvider(sysfs_root=str(tmp_path), ttl=60, backend=backend)
+    assert provider.get_brightness() is None
+    assert provider.get_brightness() is None
+    assert backend.gets == 1  # the failure is cached for ttl too
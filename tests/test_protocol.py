@@ -0,0 +1,166 @@
+import json
+
+import pytest
+
+from protocol import (
+    PROTOCOL_JSON, PROTOCOL_BINARY, SYNC, FRAME_MESSAGE, FRAME_JSON, FRAME_RAW, FRAME_CHUNK,
+    FrameError, StreamDecoder, encode_frame, decode_frame, encode_message, decode_message,
+    get_codec,
+)
+
+
+def _decode(frame):
+    frame_type, payload, consumed = decode_frame(frame)
+    assert consumed == len(frame)
+    return decode_message(frame_type, payload)
+
+
+# ------------ Messages ------------
+
+
+@pytest.mark.parametrize("msg", [
+    {"setVolume": 40},
+    {"setBrightness": 0, "setVolume": 100},
+    {"command": "copy"},
+    {"unknown_key": [1, 2, 3], "setVolume": 5},
+    {},
+])
+def test_message_round_trip(msg):
+    assert _decode(encode_message(msg)) == msg
+
+
+def test_known_keys_use_field_frames():
+    assert encode_message({"setVolume": 40})[2] == FRAME_MESSAGE
+    assert encode_message({"unknown_key": 1})[2] == FRAME_JSON
+
+
+def test_raw_and_chunk_round_trip():
+    codec = get_codec(PROTOCOL_BINARY)
+    assert _decode(encode_frame(FRAME_RAW, b"\x00\x01pixels")) == b"\x00\x01pixels"
+    assert _decode(codec.encode_chunk(7, b"data")) == {"seq": 7, "chunk": b"data"}
+
+
+def test_decode_frame_partial():
+    frame = encode_message({"setVolume": 40})
+    for cut in range(len(frame)):
+        assert decode_frame(frame[:cut]) is None
+
+
+def test_decode_frame_bad_crc():
+    frame = bytearray(encode_message({"setVolume": 40}))
+    frame[-1] ^= 0xFF
+    with pytest.raises(FrameError):
+        decode_frame(frame)
+
+
+def test_decode_message_errors():
+    with pytest.raises(FrameError):
+        decode_message(FRAME_MESSAGE, bytes([99, 1]))
+    with pytest.raises(FrameError):
+        decode_message(0x7F, b"")
+    with pytest.raises(FrameError):
+        decode_message(FRAME_CHUNK, b"\x01")
+
+
+# ------------ Stream decoding, JSON ------------
+
+
+def _json_lines(*msgs):
+    return b"".join((json.dumps(msg) + "\n").encode() for msg in msgs)
+
+
+def test_json_split_reads():
+    decoder = StreamDecoder(PROTOCOL_JSON)
+    data = _json_lines({"setVolume": 1}, {"command": "copy"})
+    out = []
+    for i in range(len(data)):
+        out += decoder.feed(data[i:i + 1])
+    assert out == [{"setVolume": 1}, {"command": "copy"}]
+
+
+def test_json_burst():
+    decoder = StreamDecoder(PROTOCOL_JSON)
+    msgs = [{"setVolume": i} for i in range(50)]
+    assert decoder.feed(_json_lines(*msgs)) == msgs
+    assert decoder.stats()["max_frames_per_read"] == 50
+
+
+def test_json_garbage_skipped():
+    decoder = StreamDecoder(PROTOCOL_JSON)
+    data = b"\x00\xffnot json\n" + _json_lines({"setVolume": 3})
+    assert decoder.feed(data) == [{"setVolume": 3}]
+    assert decoder.errors == 1
+    assert decoder.error_run == 0
+
+
+def test_json_error_budget():
+    decoder = StreamDecoder(PROTOCOL_JSON, max_errors=3)
+    decoder.feed(b"bad\n" * 3)
+    with pytest.raises(FrameError):
+        decoder.feed(b"bad\n")
+
+
+def test_json_good_line_resets_budget():
+    decoder = StreamDecoder(PROTOCOL_JSON, max_errors=3)
+    for _ in range(5):
+        decoder.feed(b"bad\n" * 3 + _json_lines({"setVolume": 1}))
+    assert decoder.errors == 15
+
+
+# ------------ Stream decoding, bin1 ------------
+
+
+def test_bin_split_reads():
+    decoder = StreamDecoder(PROTOCOL_BINARY)
+    data = encode_message({"setVolume": 40}) + encode_message({"command": "paste"})
+    out = []
+    for i in range(len(data)):
+        out += decoder.feed(data[i:i + 1])
+    assert out == [{"setVolume": 40}, {"command": "paste"}]
+    assert decoder.errors == 0
+
+
+def test_bin_burst():
+    decoder = StreamDecoder(PROTOCOL_BINARY)
+    msgs = [{"setVolume": i} for i in range(50)]
+    assert decoder.feed(b"".join(encode_message(msg) for msg in msgs)) == msgs
+
+
+def test_bin_garbage_resyncs():
+    decoder = StreamDecoder(PROTOCOL_BINARY)
+    data = b"\x01\x02garbage" + SYNC[:1] + encode_message({"setVolume": 40})
+    assert decoder.feed(data) == [{"setVolume": 40}]
+    assert decoder.resyncs >= 1
+    assert decoder.buffer == bytearray()
+
+
+def test_bin_trailing_sync_byte_kept():
+    decoder = StreamDecoder(PROTOCOL_BINARY)
+    frame = encode_message({"setVolume": 40})
+    assert decoder.feed(b"junk" + frame[:1]) == []
+    assert decoder.feed(frame[1:]) == [{"setVolume": 40}]
+
+
+def test_bin_crc_failure_costs_one_frame():
+    decoder = StreamDecoder(PROTOCOL_BINARY)
+    bad = bytearray(encode_message({"setVolume": 1}))
+    bad[-1] ^= 0xFF
+    data = bytes(bad) + encode_message({"setVolume": 2})
+    assert decoder.feed(data) == [{"setVolume": 2}]
+    assert decoder.errors == 1
+
+
+def test_bin_undecodable_message_costs_one_frame():
+    decoder = StreamDecoder(PROTOCOL_BINARY)
+    data = encode_frame(FRAME_MESSAGE, bytes([99, 1])) + encode_message({"setVolume": 40})
+    assert decoder.feed(data) == [{"setVolume": 40}]
+    assert decoder.errors == 1
+    assert decoder.buffer == bytearray()
+
+
+def test_bin_error_budget():
+    decoder = StreamDecoder(PROTOCOL_BINARY, max_errors=3)
+    bad = encode_frame(FRAME_MESSAGE, bytes([99, 1]))
+    decoder.feed(bad * 3)
+    with pytest.raises(FrameError):
+        decoder.feed(bad)